@@ -1,12 +1,30 @@
-from fastapi import FastAPI
+import os
+import logging
+import orjson
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from services.llm_service import llm_service
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, Field
+from dotenv import load_dotenv
+
+# Load .env before importing the services, which read their settings from the environment
+load_dotenv()
+
+# Uvicorn only configures its own loggers; send the services' logs to stderr too
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "WARNING"),
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+)
+
+from services.llm_service import LLMService
 
 
 def calculate_total_learning_time(node: dict) -> float:
     """
     Calculate total learning time for a node including all its children.
+    Walks the tree iteratively (post-order) so deep trees can't hit the recursion limit.
     
     Args:
         node: A node in the knowledge tree
@@ -14,28 +32,73 @@ def calculate_total_learning_time(node: dict) -> float:
     Returns:
         Total learning time in minutes (self + all descendants)
     """
-    # Get self learning time (default to 10 if not provided)
-    self_time = node.get('selfLearningTime', 10)
+    # First pass: collect nodes in pre-order, so parents always precede their children
+    order = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        order.append(current)
+        stack.extend(current.get('children', []))
     
-    # Start with self time
-    total_time = self_time
-    
-    # Add learning time from all children recursively
-    children = node.get('children', [])
-    for child in children:
-        child_total = calculate_total_learning_time(child)
-        total_time += child_total
-    
-    # Add totalLearningTime to the node
-    node['totalLearningTime'] = round(total_time, 1)
+    # Second pass: walk in reverse so every child is finished before its parent
+    totals = {}
+    for current in reversed(order):
+        children = current.get('children', [])
+        
+        # Get self learning time (default to 10 if not provided), plus all descendants
+        total_time = current.get('selfLearningTime', 10)
+        for child in children:
+            total_time += totals[id(child)]
+        totals[id(current)] = total_time
+        
+        # Add totalLearningTime to the node
+        current['totalLearningTime'] = round(total_time, 1)
+        
+        # Determine if node is atomic (leaf) or composite (has children)
+        current['isAtomic'] = len(children) == 0
     
-    # Determine if node is atomic (leaf) or composite (has children)
-    node['isAtomic'] = len(children) == 0
+    return totals[id(node)]
+
+
+def event_stream(chunks: AsyncIterator) -> StreamingResponse:
+    """
+    Wrap an async iterator of text chunks as a server-sent event stream.
+    Each text chunk is sent as a JSON payload {"text": chunk} so newlines survive framing;
+    dict items (e.g. {"cached_content": name} or {"error": kind}) are sent as-is.
+    """
+    async def generate():
+        async for chunk in chunks:
+            payload = chunk if isinstance(chunk, dict) else {'text': chunk}
+            yield b"data: " + orjson.dumps(payload) + b"\n\n"
     
-    return total_time
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Don't let proxies buffer the stream
+        }
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the LLM service once per worker after it has started, warm up its
+    connection pool, and release the pool on shutdown.
+    """
+    app.state.llm = LLMService()
+    await app.state.llm.warmup()
+    yield
+    await app.state.llm.aclose()
+
+
+def get_llm_service(request: Request) -> LLMService:
+    """Return the LLM service created for this worker."""
+    return request.app.state.llm
 
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -50,8 +113,16 @@ app.add_middleware(
 )
 
 
+# Seeding explanations into every node makes the tree slow to generate; the frontend asks for 1
+MAX_SEED_DEPTH = 2
+# One batch request fans out to one LLM call (and optionally one Wikipedia lookup) per concept
+MAX_BATCH_CONCEPTS = 20
+MAX_IMAGES = 5
+
+
 class ConceptRequest(BaseModel):
     concept: str
+    seed_depth: int = Field(0, ge=0, le=MAX_SEED_DEPTH)
 
 
 class ExplainRequest(BaseModel):
@@ -60,6 +131,14 @@ class ExplainRequest(BaseModel):
     knowledge_tree: dict
 
 
+class ExplainBatchRequest(BaseModel):
+    concept_names: List[str] = Field(..., max_length=MAX_BATCH_CONCEPTS)
+    original_query: str
+    knowledge_tree: dict
+    use_images: bool = False
+    max_images: int = Field(3, ge=0, le=MAX_IMAGES)
+
+
 class ChatRequest(BaseModel):
     concept_name: str
     original_query: str
@@ -67,48 +146,85 @@ class ChatRequest(BaseModel):
     explanation: str
     chat_history: list
     user_message: str
+    cached_content: Optional[str] = None
 
 
 @app.post("/api/knowledge-map")
-async def generate_knowledge_map(request: ConceptRequest):
+async def generate_knowledge_map(request: ConceptRequest, llm_service: LLMService = Depends(get_llm_service)):
     """
     Generate a knowledge dependency tree for a given concept.
     Returns a hierarchical tree structure showing what needs to be learned.
+    With seed_depth > 0, nodes down to that depth come with a ready "explanation".
     """
-    knowledge_tree = await llm_service.generate_knowledge_tree(request.concept)
+    knowledge_tree = await llm_service.generate_knowledge_tree(request.concept, request.seed_depth)
     
     # Calculate total learning time for all nodes (including marking atomic vs composite)
     calculate_total_learning_time(knowledge_tree)
     
-    return knowledge_tree
+    # Return the response directly: a plain dict would first go through FastAPI's
+    # jsonable_encoder, which costs far more than the orjson encoding itself
+    return ORJSONResponse(knowledge_tree)
 
 
 @app.post("/api/explain-concept")
-async def explain_concept(request: ExplainRequest):
+async def explain_concept(request: ExplainRequest, llm_service: LLMService = Depends(get_llm_service)):
     """
-    Generate a detailed explanation for a specific concept within the context
+    Stream a detailed explanation for a specific concept within the context
     of the original query and the full knowledge tree.
+    Returns a server-sent event stream of markdown chunks.
     """
-    explanation = await llm_service.explain_concept(
+    return event_stream(llm_service.explain_concept(
         request.concept_name,
         request.original_query,
         request.knowledge_tree
+    ))
+
+
+@app.post("/api/explain-batch")
+async def explain_batch(request: ExplainBatchRequest, llm_service: LLMService = Depends(get_llm_service)):
+    """
+    Generate explanations for several concepts of the same knowledge tree in one call,
+    e.g. to prefetch a whole subtree. Images are only looked up when use_images is set.
+    """
+    result = await llm_service.explain_concepts_batch(
+        request.concept_names,
+        request.original_query,
+        request.knowledge_tree,
+        use_images=request.use_images,
+        max_images=request.max_images
     )
-    return {"explanation": explanation}
+    return ORJSONResponse(result)
 
 
 @app.post("/api/chat-about-explanation")
-async def chat_about_explanation(request: ChatRequest):
+async def chat_about_explanation(request: ChatRequest, llm_service: LLMService = Depends(get_llm_service)):
     """
     Handle chat messages about the explanation with full context.
     Maintains conversation history for the current explanation session.
+    Returns a server-sent event stream of markdown chunks.
     """
-    response = await llm_service.chat_about_explanation(
+    return event_stream(llm_service.chat_about_explanation(
         request.concept_name,
         request.original_query,
         request.knowledge_tree,
         request.explanation,
         request.chat_history,
-        request.user_message
+        request.user_message,
+        request.cached_content
+    ))
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Each worker is a separate process with its own LLMService; uvloop and httptools
+    # replace the pure-Python event loop and HTTP parser
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+        loop="uvloop",
+        http="httptools",
+        limit_concurrency=200
     )
-    return {"response": response} 
\ No newline at end of file
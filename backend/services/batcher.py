@@ -0,0 +1,78 @@
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional
+
+
+class AsyncBatcher:
+    """
+    Coalesce concurrent requests into micro-batches.
+
+    Items submitted within `max_queue_time` seconds of each other (up to
+    `max_batch_size` items) are handed to `process_batch` together, for work that
+    can be merged into one LLM request, and each caller awaits only its own result.
+
+    Args:
+        process_batch: Async function that processes a batch of items and returns
+            one result (or exception) per item, in the same order
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], Awaitable[List[Any]]], max_batch_size: int = 8, max_queue_time: float = 0.02):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_queue_time = max_queue_time
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._running: set = set()
+
+    async def process(self, item: Any) -> Any:
+        """
+        Queue an item for the next batch and wait for its result.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_queue_time, self._flush)
+
+        return await future
+
+    def _flush(self):
+        """
+        Dispatch everything queued so far as one batch.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        # Keep a reference so the task is not garbage collected mid-flight
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch: List[tuple]):
+        """
+        Run a batch and resolve each caller's future with its own result.
+        """
+        items = [item for item, _ in batch]
+        try:
+            results = await self.process_batch(items)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            # The caller may have given up (e.g. timed out) while we were waiting
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
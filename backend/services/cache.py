@@ -0,0 +1,163 @@
+import os
+import copy
+import asyncio
+import logging
+import itertools
+import orjson
+import time
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import diskcache
+
+logger = logging.getLogger(__name__)
+
+# All on-disk caches live under one root (relative to the working directory by default)
+CACHE_ROOT = os.getenv("CACHE_DIR", ".cache")
+DEFAULT_CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(CACHE_ROOT, "llm"))
+DEFAULT_TTL = 86400  # Keep cached LLM results for 24 hours
+
+
+def make_cache_key(method: str, **parts) -> str:
+    """
+    Build a stable cache key for an LLM call from the method name and its inputs.
+    Inputs are canonicalized with sorted keys so equal trees produce equal keys.
+    """
+    payload = orjson.dumps({"m": method, **parts}, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache for LLM results: a small in-process LRU in front of an
+    on-disk store that survives restarts and is shared between workers.
+
+    Once started, disk writes go through a background queue so request
+    handlers never wait on SQLite, and the LRU is pre-filled from disk.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_memory_items: int = 256, ttl: int = DEFAULT_TTL):
+        self.memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.max_memory_items = max_memory_items
+        self.ttl = ttl
+        self.disk = diskcache.Cache(directory)
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """
+        Load previously cached results into memory and start the background disk writer.
+        """
+        try:
+            await asyncio.to_thread(self._load_from_disk)
+        except Exception as e:
+            logger.warning("Error loading LLM cache: %s", e)
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_behind())
+
+    async def aclose(self):
+        """
+        Flush pending disk writes and stop the background writer.
+        """
+        if self._writer is None:
+            return
+        await self._queue.join()
+        self._writer.cancel()
+        self._writer = None
+        self._queue = None
+        self.disk.close()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached value, checking memory first and then disk.
+        Returns None on a miss.
+        """
+        entry = self.memory.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.time():
+                self.memory.move_to_end(key)
+                # Callers may mutate returned trees, so hand out a copy
+                return copy.deepcopy(value)
+            del self.memory[key]
+
+        try:
+            value, expires_at = self.disk.get(key, expire_time=True)
+        except Exception as e:
+            logger.warning("Error reading LLM cache: %s", e)
+            return None
+
+        if value is not None:
+            # Keep the disk entry's own expiry, e.g. a short negative-cache TTL set by another worker
+            self._remember(key, copy.deepcopy(value), expires_at)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None):
+        """
+        Store a successful result in both tiers.
+        Error responses should never be passed here.
+
+        Args:
+            key: Cache key from make_cache_key
+            value: The result to store
+            ttl: Seconds to keep this entry, if different from the cache's default
+        """
+        ttl = ttl or self.ttl
+        # The copy is never handed out directly, so the disk writer can share it
+        value = copy.deepcopy(value)
+        self._remember(key, value, time.time() + ttl)
+        if self._queue is not None:
+            self._queue.put_nowait((key, value, ttl))
+            return
+        self._write(key, value, ttl)
+
+    def merge(self, key: str, merge: Callable[[Optional[Any]], Any], ttl: Optional[int] = None):
+        """
+        Atomically replace the disk value of key with merge(current disk value), for state
+        that several worker processes share. Runs synchronously, bypassing the write queue.
+        """
+        try:
+            with self.disk.transact():
+                value = merge(self.disk.get(key))
+                self.disk.set(key, value, expire=ttl or self.ttl)
+        except Exception as e:
+            logger.warning("Error merging LLM cache entry: %s", e)
+            return
+        self._remember(key, copy.deepcopy(value), time.time() + (ttl or self.ttl))
+
+    def _write(self, key: str, value: Any, ttl: int):
+        try:
+            self.disk.set(key, value, expire=ttl)
+        except Exception as e:
+            logger.warning("Error writing LLM cache: %s", e)
+
+    async def _write_behind(self):
+        """
+        Persist queued results one at a time off the event loop.
+        """
+        while True:
+            key, value, ttl = await self._queue.get()
+            try:
+                await asyncio.to_thread(self._write, key, value, ttl)
+            finally:
+                self._queue.task_done()
+
+    def _load_from_disk(self):
+        """
+        Fill the in-memory LRU with up to max_memory_items unexpired disk entries.
+        """
+        for key in itertools.islice(self.disk.iterkeys(), self.max_memory_items):
+            value, expires_at = self.disk.get(key, expire_time=True)
+            if value is not None:
+                self._remember(key, value, expires_at)
+
+    def _remember(self, key: str, value: Any, expires_at: Optional[float] = None):
+        """
+        Insert a value into the in-memory LRU, evicting the oldest entry when full.
+        """
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_items:
+            self.memory.popitem(last=False)
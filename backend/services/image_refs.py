@@ -0,0 +1,94 @@
+import re
+from typing import List, Dict, Optional
+
+# Runs of three or more newlines; applied to every streamed chunk, so compiled once
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+# An [IMG:X] reference; one pass over a line replaces all of them, however many images there are
+_IMG_REF_RE = re.compile(r'\[IMG:(\d+)\]')
+
+
+def image_markdown(images: List[Dict]) -> List[str]:
+    """
+    Build the markdown snippet that replaces each [IMG:X] reference.
+    """
+    snippets = []
+    for i, img in enumerate(images):
+        caption = img['caption'][:100] if img['caption'] else f"Image {i}"
+        snippets.append(f"\n\n![{caption}]({img['url']})\n\n")
+    return snippets
+
+
+class ImageReferenceFilter:
+    """
+    Incrementally post-process streamed LLM markdown that may contain [IMG:X] references.
+
+    Text is processed line by line (an [IMG:X] reference never spans lines):
+    - Lines containing Wikipedia upload URLs are dropped (the LLM sometimes ignores instructions)
+    - [IMG:X] references are converted to markdown images with the correct URLs; with
+      max_images, references to further distinct images after the first max_images are dropped
+    - Runs of three or more newlines are collapsed to a single blank line
+    """
+
+    def __init__(self, images: List[Dict], max_images: Optional[int] = None):
+        self.references = {str(i): md for i, md in enumerate(image_markdown(images))}
+        self.max_images = max_images
+        self._used = set()
+        self._partial_line = ''
+        self._trailing_newlines = 0
+        self._started = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Add a chunk of streamed text and return the part that is ready to send.
+        """
+        self._partial_line += chunk
+        if '\n' not in self._partial_line:
+            return ''
+        complete, self._partial_line = self._partial_line.rsplit('\n', 1)
+        return self._emit(''.join(self._convert_line(line) + '\n' for line in complete.split('\n')
+                                  if not self._is_url_line(line)))
+
+    def flush(self) -> str:
+        """
+        Return whatever is still buffered once the stream has ended.
+        """
+        line, self._partial_line = self._partial_line, ''
+        if not line or self._is_url_line(line):
+            return ''
+        return self._emit(self._convert_line(line))
+
+    def _is_url_line(self, line: str) -> bool:
+        return 'upload.wikimedia.org' in line.lower()
+
+    def _convert_line(self, line: str) -> str:
+        if self.references and '[IMG:' in line:
+            return _IMG_REF_RE.sub(self._replace_reference, line)
+        return line
+
+    def _replace_reference(self, match: re.Match) -> str:
+        key = match.group(1)
+        # References to images that don't exist are left as written
+        if key not in self.references:
+            return match.group(0)
+        if key not in self._used:
+            if self.max_images is not None and len(self._used) >= self.max_images:
+                return ''
+            self._used.add(key)
+        return self.references[key]
+
+    def _emit(self, text: str) -> str:
+        """
+        Collapse blank-line runs, including runs that span chunk boundaries.
+        """
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ''
+            self._started = True
+
+        # Prefix the newlines already sent so runs across chunks collapse correctly,
+        # then drop them again from the output
+        combined = '\n' * self._trailing_newlines + text
+        collapsed = _BLANK_LINES_RE.sub('\n\n', combined)
+        self._trailing_newlines = len(collapsed) - len(collapsed.rstrip('\n'))
+        return collapsed[len(combined) - len(text):]
@@ -1,118 +1,419 @@
 import os
+import copy
 import asyncio
+import logging
 import argparse
-import json
+import orjson
+import json_repair
+import httpx
 import re
-from typing import Optional, List, Dict
-from dotenv import load_dotenv
-load_dotenv()
-from langchain_google_genai import ChatGoogleGenerativeAI
-import google.generativeai as genai
+from typing import Optional, List, Dict, Tuple, AsyncIterator, Awaitable, Callable
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception, stop_after_attempt, wait_random_exponential
 from google import genai as google_genai
+from google.genai import types as genai_types
+from google.genai import errors as genai_errors
 from services.wiki import WikiImageRetrieval
+from services.cache import LLMCache, make_cache_key
+from services.semantic_cache import SemanticIndex
+from services.rate_limit import ModelRateLimiter
+from services.batcher import AsyncBatcher
+from services.prompts import (
+    TREE_SYSTEM_PROMPT,
+    TREE_USER_PROMPT,
+    TREE_SEED_EXPLANATIONS,
+    EXPLAIN_PROMPT_HEADER,
+    EXPLAIN_IMAGES_HEADER,
+    EXPLAIN_IMAGE_ITEM,
+    EXPLAIN_IMAGE_FORMAT_RULES,
+    EXPLAIN_GUIDELINES,
+    EXPLAIN_GUIDELINES_WITH_IMAGES,
+    EXPLAIN_GUIDELINES_WITHOUT_IMAGES,
+    EXPLAIN_PROMPT_FOOTER,
+    CHAT_PROMPT_HEADER,
+    CHAT_PROMPT_FOOTER,
+    MAX_EXPLANATION_TOKENS,
+    MAX_TURN_TOKENS,
+    MAX_QUESTION_TOKENS,
+    MAX_OUTLINE_TOKENS,
+    estimate_tokens,
+    bounded_tree_outline,
+    concept_path_outline,
+    trim_chat_history,
+    clip_text,
+)
+from services.image_refs import ImageReferenceFilter
+
+logger = logging.getLogger(__name__)
 
 # DEFAULT_MODEL = "models/gemma-3-1b-it"
 DEFAULT_MODEL = "models/gemma-3-27b-it"
 # DEFAULT_MODEL = "models/gemini-2.0-flash-exp"
 
+# Knowledge trees are short structured JSON, which a small fast model handles as well
+# as the large one; it also supports JSON mode, unlike Gemma
+DEFAULT_TREE_MODEL = "models/gemini-2.0-flash-lite"
+# Stronger model that takes over when the fast tree model's answer is unusable or late;
+# the fast model gets this share of the tree deadline before escalating
+DEFAULT_TREE_ESCALATION_MODEL = "models/gemini-2.0-flash"
+TREE_FAST_TIMEOUT_SHARE = 0.5
+
+# Explicit Gemini context caching for the static part of chat prompts
+CONTEXT_CACHE_TTL_SECONDS = 1800
+CONTEXT_CACHE_TTL = f"{CONTEXT_CACHE_TTL_SECONDS}s"
+CONTEXT_CACHE_MIN_TOKENS = 1024  # Gemini rejects cached contents smaller than this
+# The cache is created before the first chat chunk, so a slow upload falls back to the full prompt
+CONTEXT_CACHE_TIMEOUT = 3.0
+
+# JSON schema for structured tree output; nodes nest recursively through $ref
+TREE_SCHEMA = {
+    "$defs": {
+        "node": {
+            "type": "object",
+            "properties": {
+                "name": {"type": "string"},
+                "description": {"type": "string"},
+                "selfLearningTime": {"type": "number"},
+                "explanation": {"type": "string"},  # Only for seeded nodes, see TREE_SEED_EXPLANATIONS
+                "children": {"type": "array", "items": {"$ref": "#/$defs/node"}}
+            },
+            "required": ["name", "description", "selfLearningTime", "children"]
+        }
+    },
+    "$ref": "#/$defs/node"
+}
+
+# Near-duplicate tree requests are matched by embedding similarity before generating.
+# A small output dimension keeps the lookup matrix cheap. Generation waits at most
+# EMBEDDING_LOOKUP_WAIT seconds for the embedding; a slower one is only used to index
+# the new tree once it is generated.
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_DIMENSIONS = 256
+EMBEDDING_TIMEOUT = 2.0
+EMBEDDING_LOOKUP_WAIT = 0.3
+# Related but distinct concepts (siblings like "Linear regression" and "Logistic
+# regression") already score around 0.9, so only near-identical phrasings qualify
+TREE_SIMILARITY_THRESHOLD = 0.97
+TREE_INDEX_KEY = make_cache_key("tree_index", dimensions=EMBEDDING_DIMENSIONS)
+
+# Wikipedia pages change over days, so their image lists are cached; pages without
+# usable images are remembered for a shorter time in case they get some
+WIKI_IMAGES_TTL = 86400
+WIKI_NO_IMAGES_TTL = 3600
+
+# Image selection always uses the large Gemma model, whatever the explanation model is
+IMAGE_SELECTION_MODEL = "models/gemma-3-27b-it"
+# Maximum number of concepts whose images are chosen in one LLM request
+IMAGE_SELECTION_BATCH_SIZE = 8
+
+# Maximum number of explanations generated concurrently by explain_concepts_batch
+EXPLAIN_BATCH_CONCURRENCY = 10
+EXPLAIN_BATCH_TIMEOUT = 60.0
+# Upper bound on images per batch explanation, whatever the caller asks for
+EXPLAIN_BATCH_MAX_IMAGES = 5
+
+# The explanation can't start streaming until images are chosen, so cap how long
+# the Wikipedia lookup may delay the first token
+IMAGE_LOOKUP_TIMEOUT = 8.0
+
+# Read timeouts fire before the outer per-request deadlines, so a stalled
+# stream is torn down by httpx and its connection goes back to the pool
+HTTP_TIMEOUT = httpx.Timeout(connect=3.0, read=40.0, write=5.0, pool=5.0)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+
+def _strip_code_fence(text: str) -> str:
+    """
+    Remove a markdown code fence (``` or ```json) wrapped around an LLM response.
+    """
+    if text.startswith("```"):
+        # Drop the opening fence line, whatever language tag it carries
+        text = text.split("\n", 1)[1] if "\n" in text else text[3:]
+        text = text.removesuffix("```").rstrip()
+    return text
+
+
+def _extract_json(text: str) -> str:
+    """
+    Cut an LLM response down to the JSON object in it, dropping a code fence and any
+    prose the model wrote before or after the object.
+    """
+    text = _strip_code_fence(text.strip())
+    start = text.find("{")
+    if start == -1:
+        return text
+    end = text.rfind("}")
+    # A truncated response has no closing brace; keep the tail for json_repair to close
+    return text[start:end + 1] if end > start else text[start:]
+
+
+# Error messages that mean the API quota or the request rate limit was hit, for
+# exceptions that don't carry an HTTP status
+_QUOTA_RE = re.compile(r"quota|429|ResourceExhausted", re.IGNORECASE)
+_RATE_LIMIT_RE = re.compile(r"rate limit|too many requests", re.IGNORECASE)
+
+
+# Trees returned instead of a knowledge map when the API refuses the request
+ERROR_TREES = {
+    "quota": {
+        "name": "⚠️ Quota Exceeded",
+        "description": "API quota limit reached. Please try again later or check your API plan and billing details.",
+        "selfLearningTime": 0,
+        "children": [],
+        "error": "quota_exceeded"
+    },
+    "rate_limit": {
+        "name": "⚠️ Rate Limit",
+        "description": "Too many requests. Please wait a moment and try again.",
+        "selfLearningTime": 0,
+        "children": [],
+        "error": "rate_limit"
+    },
+}
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    """
+    HTTP status of a google-genai or httpx error, or None for other exceptions.
+    """
+    if isinstance(error, genai_errors.APIError):
+        return error.code
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def _classify_error(error: Exception) -> str:
+    """
+    Classify an LLM API error as "quota", "rate_limit" or "other".
+    SDK errors are classified by their status code (Gemini answers 429 RESOURCE_EXHAUSTED
+    when the quota is used up); only exceptions without one have their message scanned.
+    """
+    status = _status_code(error)
+    if status is not None:
+        return "quota" if status == 429 else "other"
+    message = str(error)
+    if _QUOTA_RE.search(message):
+        return "quota"
+    if _RATE_LIMIT_RE.search(message):
+        return "rate_limit"
+    return "other"
+
+
+# Retry policy for direct google-genai calls: a few attempts with jittered exponential
+# backoff, so a burst of 429s doesn't retry in lockstep. Waits start around 300 ms and
+# stay short, so retries fit inside the 15-45 s request deadlines.
+LLM_RETRY_ATTEMPTS = 3
+_retry_backoff = wait_random_exponential(multiplier=0.3, max=4)
+_RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """
+    Whether an API error is transient: timeouts, rate limits and server-side failures.
+    """
+    # httpx.TransportError covers connection resets and httpx's own timeouts
+    if isinstance(error, (TimeoutError, httpx.TransportError)):
+        return True
+    return _status_code(error) in _RETRYABLE_STATUS_CODES
+
+
+def _retry_wait(retry_state: RetryCallState) -> float:
+    """
+    Wait as long as the server's Retry-After header asks, otherwise back off with jitter.
+    """
+    error = retry_state.outcome.exception()
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    retry_after = headers.get("retry-after") if headers else None
+    try:
+        return min(float(retry_after), 20.0)
+    except (TypeError, ValueError):
+        return _retry_backoff(retry_state)
+
+
+async def _call_with_retry(make_call: Callable[[], Awaitable]):
+    """
+    Await make_call(), retrying transient API errors.
+    The caller's own timeout still bounds the total time spent, including waits.
+    """
+    retrying = AsyncRetrying(
+        wait=_retry_wait,
+        stop=stop_after_attempt(LLM_RETRY_ATTEMPTS),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True
+    )
+    async for attempt in retrying:
+        with attempt:
+            return await make_call()
+
+
+def _is_valid_tree(tree) -> bool:
+    """
+    Structural sanity check for a generated knowledge tree: every node has a name, a
+    list of children and a numeric selfLearningTime if it has one at all, and the root
+    has at least one prerequisite.
+    """
+    if not isinstance(tree, dict) or not tree.get("children"):
+        return False
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict) or not node.get("name") or not isinstance(node.get("children"), list):
+            return False
+        learning_time = node.get("selfLearningTime", 0)
+        if isinstance(learning_time, bool) or not isinstance(learning_time, (int, float)):
+            return False
+        stack.extend(node["children"])
+    return True
+
+
+# Candidate images are sent with one-letter keys to save input tokens; the prompt explains them
+IMAGE_CANDIDATE_LEGEND = 'Each image is listed as {"i": index, "c": caption, "s": text of the section it appears in}.'
+
+
+def _image_candidates(images: List[Dict]) -> List[Dict]:
+    """
+    Describe the candidate images of a page for the selection prompt.
+    The first 20 are enough to choose from and keep the prompt small.
+    """
+    return [
+        {'i': i, 'c': (img['caption'] or '')[:200], 's': (img.get('section_text') or '')[:200]}
+        for i, img in enumerate(images[:20])
+    ]
+
+
+def _as_int(value) -> Optional[int]:
+    """
+    An id from an LLM's JSON as an int; models sometimes write numbers as strings ("2").
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pick_images(images: List[Dict], selections: List[Dict]) -> Optional[List[Dict]]:
+    """
+    Turn the LLM's {"index", "reason"} selections into image dicts with the reason attached.
+    """
+    selected_images = []
+    for selection in selections:
+        idx = _as_int(selection.get('index')) if isinstance(selection, dict) else None
+        if idx is not None and 0 <= idx < len(images):
+            img = images[idx].copy()
+            img['reason'] = selection.get('reason', '')
+            selected_images.append(img)
+    return selected_images if selected_images else None
+
+
 class LLMService:
-    def __init__(self, model: str = DEFAULT_MODEL):  
-        self.llm = ChatGoogleGenerativeAI(
-            model=model,
-            temperature=0.7,
-            convert_system_message_to_human=True,
-            google_api_key=os.getenv("GOOGLE_API_KEY"),
-            max_retries=0,  # Don't retry on failures
-            request_timeout=10  # Reduced timeout to fail faster
+    def __init__(
+        self,
+        model: str = DEFAULT_MODEL,
+        tree_model: str = DEFAULT_TREE_MODEL,
+        tree_escalation_model: str = DEFAULT_TREE_ESCALATION_MODEL
+    ):
+        self.model = model
+        self.tree_model = tree_model
+        self.tree_escalation_model = tree_escalation_model
+        # How many trees the fast model produced vs. how many needed the escalation model
+        self.tree_stats = {"fast": 0, "escalated": 0}
+        # Shared HTTP/2 connection pool for all google-genai calls, so TLS handshakes are
+        # paid once per worker and concurrent requests are multiplexed over one socket
+        self.http_client = httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+        self.genai_client = google_genai.Client(
+            api_key=os.getenv("GOOGLE_API_KEY"),
+            http_options=genai_types.HttpOptions(httpx_async_client=self.http_client)
         )
-        self.genai_client = google_genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
-        self.wiki_tool = WikiImageRetrieval()
+        # Keep under the API's per-model RPM/TPM limits instead of discovering them as 429s
+        self.rate_limiter = ModelRateLimiter()
+        self.wiki_tool = WikiImageRetrieval(http_client=self.http_client)
+        self.cache = LLMCache()
+        # Embeddings of concepts with a cached tree, for reusing trees of near-duplicate concepts
+        self.tree_index = SemanticIndex(EMBEDDING_DIMENSIONS, threshold=TREE_SIMILARITY_THRESHOLD)
+        # Image choices for concepts explained at the same time are made in one request
+        self.image_batcher = AsyncBatcher(self._select_relevant_images_batch, max_batch_size=IMAGE_SELECTION_BATCH_SIZE)
+        # Tree generations in flight, keyed like the cache, so identical concurrent requests share one call
+        self._inflight_trees: Dict[str, asyncio.Task] = {}
+        # Shared by all batch explanations, so concurrent batches don't multiply the fan-out
+        self._explain_semaphore = asyncio.Semaphore(EXPLAIN_BATCH_CONCURRENCY)
     
-    async def generate_knowledge_tree(self, concept: str) -> dict:
+    async def generate_knowledge_tree(self, concept: str, seed_depth: int = 0) -> dict:
         """
         Generate a hierarchical knowledge dependency tree for a given concept.
         Returns a structured JSON tree showing prerequisites and dependencies.
+        
+        Args:
+            concept: The concept to map
+            seed_depth: If positive, nodes down to this depth also get an "explanation" field,
+                generated in the same LLM call, so the most likely clicks need no extra round-trip
         """
-        prompt = f"""You are a knowledge mapping expert. Create a comprehensive learning dependency tree for the concept: "{concept}"
-
-IMPORTANT CONCEPTS:
-- **Atomic Concept**: A fundamental, indivisible concept that can be learned in 5-15 minutes (leaf nodes with no children)
-- **Composite Concept**: A higher-level concept that requires understanding multiple atomic concepts (non-leaf nodes with children)
-
-Please structure your response as a JSON object with the following format:
-{{
-  "name": "Main Concept",
-  "description": "Brief description of the concept",
-  "selfLearningTime": 10,
-  "children": [
-    {{
-      "name": "Prerequisite 1 (Composite)",
-      "description": "Brief description",
-      "selfLearningTime": 8,
-      "children": [
-        {{
-          "name": "Sub-prerequisite 1.1 (Atomic)",
-          "description": "Brief description",
-          "selfLearningTime": 12,
-          "children": []
-        }}
-      ]
-    }},
-    {{
-      "name": "Prerequisite 2 (Atomic)",
-      "description": "Brief description",
-      "selfLearningTime": 7,
-      "children": []
-    }}
-  ]
-}}
+        # Collapse stray whitespace, and ignore case for caching, so "Linear  algebra "
+        # and "linear algebra" share one generated tree
+        concept = " ".join(concept.split())
+        cache_key = make_cache_key("tree", concept=concept.casefold(), seed_depth=seed_depth)
+        cached_tree = self.cache.get(cache_key)
+        if cached_tree is not None:
+            return cached_tree
+        
+        # Singleflight: the first request starts the generation and identical requests arriving
+        # before it finishes wait for the same task. The task is shielded so a client that
+        # disconnects doesn't cancel it for the others.
+        task = self._inflight_trees.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(self._generate_knowledge_tree(concept, seed_depth, cache_key))
+            self._inflight_trees[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight_trees.pop(cache_key, None))
+        tree = await asyncio.shield(task)
+        # Callers annotate the tree in place, so each gets its own copy
+        return copy.deepcopy(tree)
+    
+    async def _generate_knowledge_tree(self, concept: str, seed_depth: int, cache_key: str) -> dict:
+        """
+        Run one tree generation for generate_knowledge_tree and cache a successful result.
+        A cached tree for a near-duplicate concept is reused instead of calling the LLM,
+        if the concept's embedding arrives within EMBEDDING_LOOKUP_WAIT seconds.
+        """
+        # _embed_concept never raises and gives up after EMBEDDING_TIMEOUT, so the task
+        # can safely be left running if the generation fails
+        embed_task = asyncio.ensure_future(self._embed_concept(concept))
+        await asyncio.wait([embed_task], timeout=EMBEDDING_LOOKUP_WAIT)
+        embedding = embed_task.result() if embed_task.done() else None
+        if embedding is not None:
+            match = self.tree_index.lookup(embedding)
+            if match is not None:
+                similar_concept, similarity = match
+                similar_tree = self.cache.get(make_cache_key("tree", concept=similar_concept, seed_depth=seed_depth))
+                if similar_tree is not None:
+                    logger.info("Reusing the tree for %r for %r (similarity %.3f)", similar_concept, concept, similarity)
+                    # The map is shown under the concept the user asked for
+                    similar_tree["name"] = concept
+                    self.cache.set(cache_key, similar_tree)
+                    return similar_tree
 
-Rules:
-1. The root should be the main concept: "{concept}"
-2. Children should be prerequisites or foundational knowledge needed to understand the parent
-3. Each node MUST have: "name", "description", "selfLearningTime" (in minutes), and "children" fields
-4. **ATOMIC CONCEPTS (Leaf nodes):**
-   - Must have NO children (empty children array)
-   - Must be truly indivisible, basic concepts
-   - selfLearningTime should be between 5-15 minutes
-   - Examples: "Number", "Addition", "Subtraction"
-5. **COMPOSITE CONCEPTS (Non-leaf nodes):**
-   - Must have at least one child
-   - Represent concepts that combine multiple atomic concepts
-   - selfLearningTime is the time to understand the concept itself (5-15 min), not including children
-   - Examples broken down: "Vector Addition" → ["Vector", "Addition"]
-6. DO NOT use broad field or subjectnames such as "Linear Algebra" or "Calculus" as composite or atomic concepts
-7. Expand composite concepts deeply - ensure leaf nodes are truly atomic and basic
-8. If a concept seems too complex for 5-15 minutes, it's composite - break it down further
-9. Focus on the logical learning path from fundamentals to advanced
-10. Estimate selfLearningTime realistically based on concept complexity (always 5-15 minutes)
-11. IMPORTANT: Return ONLY valid JSON, no markdown formatting, no extra text
-
-Generate the knowledge dependency tree for: {concept}"""
+        prompt = TREE_USER_PROMPT.format(concept=concept)
+        if seed_depth > 0:
+            prompt += TREE_SEED_EXPLANATIONS.format(seed_depth=seed_depth)
 
         try:
-            # Use asyncio.wait_for to enforce a hard timeout
-            response = await asyncio.wait_for(
-                asyncio.to_thread(self.llm.invoke, prompt),
-                timeout=45.0  # Hard timeout of 45 seconds for tree generation
-            )
-            response_text = response.content if hasattr(response, 'content') else str(response)
-            
-            # Try to extract JSON from response
-            response_text = response_text.strip()
-            
-            # Remove markdown code blocks if present
-            if response_text.startswith("```"):
-                response_text = re.sub(r'^```(?:json)?\n', '', response_text)
-                response_text = re.sub(r'\n```$', '', response_text)
+            # Hard timeout of 45 seconds for tree generation (90 with seeded explanations, which make
+            # the response several times longer); cancellation propagates straight into the request
+            timeout = 45.0 if seed_depth <= 0 else 90.0
+            async with asyncio.timeout(timeout):
+                response_text = await self._generate_tree_with_escalation(prompt, timeout * TREE_FAST_TIMEOUT_SHARE)
             
             # Parse the JSON
-            tree_data = json.loads(response_text)
+            tree_data = orjson.loads(response_text)
             
+            self.cache.set(cache_key, tree_data)
+            # Index the tree once its embedding is in, without holding back the response
+            def index_tree(task: asyncio.Future):
+                if task.result() is not None:
+                    self.tree_index.add(concept.casefold(), task.result())
+            embed_task.add_done_callback(index_tree)
             return tree_data
         
-        except asyncio.TimeoutError:
-            print("Knowledge tree generation timed out")
+        except TimeoutError:
+            logger.warning("Knowledge tree generation timed out")
             return {
                 "name": concept,
                 "description": "⚠️ Request timed out. This might be due to API rate limits. Please try again in a moment.",
@@ -121,9 +422,17 @@ Generate the knowledge dependency tree for: {concept}"""
                 "error": "timeout"
             }
             
-        except json.JSONDecodeError as e:
-            print(f"JSON Parse Error: {e}")
-            print(f"Response was: {response_text[:500]}")
+        except orjson.JSONDecodeError as e:
+            # Only slice out the snippet when the warning will actually be emitted
+            if logger.isEnabledFor(logging.WARNING):
+                logger.warning("JSON parse error: %s; response was: %s", e, response_text[:500])
+            
+            # Try to recover a truncated or slightly malformed tree before giving up; it must
+            # pass the same sanity check as a model answer, or annotating it would fail.
+            # A repaired tree isn't cached, so the next request gets a fresh attempt.
+            repaired = json_repair.loads(response_text)
+            if _is_valid_tree(repaired):
+                return repaired
             
             # Return a fallback structure
             return {
@@ -152,28 +461,13 @@ Generate the knowledge dependency tree for: {concept}"""
                 ]
             }
         except Exception as e:
-            error_str = str(e)
-            print(f"Error generating knowledge tree: {e}")
+            error_kind = _classify_error(e)
+            logger.exception("Error generating knowledge tree")
             
-            # Check if it's a quota error - return immediately
-            if "quota" in error_str.lower() or "429" in error_str or "ResourceExhausted" in error_str or "Quota exceeded" in error_str:
-                return {
-                    "name": "⚠️ Quota Exceeded",
-                    "description": "API quota limit reached. Please try again later or check your API plan and billing details.",
-                    "selfLearningTime": 0,
-                    "children": [],
-                    "error": "quota_exceeded"
-                }
-            
-            # Check for rate limit errors
-            if "rate limit" in error_str.lower() or "too many requests" in error_str.lower():
-                return {
-                    "name": "⚠️ Rate Limit",
-                    "description": "Too many requests. Please wait a moment and try again.",
-                    "selfLearningTime": 0,
-                    "children": [],
-                    "error": "rate_limit"
-                }
+            # Quota and rate limit errors get a fixed tree; callers annotate trees in place,
+            # so each gets its own copy with its own children list
+            if error_kind in ERROR_TREES:
+                return {**ERROR_TREES[error_kind], "children": []}
             
             return {
                 "name": concept,
@@ -183,48 +477,152 @@ Generate the knowledge dependency tree for: {concept}"""
                 "error": "generation_failed"
             }
     
+    async def _embed_concept(self, concept: str) -> Optional[List[float]]:
+        """
+        Embed a concept name for similarity lookup.
+        Returns None if the embedding call fails or is slow, so generation goes ahead without it.
+        """
+        try:
+            async with asyncio.timeout(EMBEDDING_TIMEOUT):
+                response = await self.genai_client.aio.models.embed_content(
+                    model=EMBEDDING_MODEL,
+                    contents=concept,
+                    config=genai_types.EmbedContentConfig(
+                        task_type="SEMANTIC_SIMILARITY",
+                        output_dimensionality=EMBEDDING_DIMENSIONS
+                    )
+                )
+            return response.embeddings[0].values
+        except Exception as e:
+            logger.warning("Could not embed concept %r: %s", concept, e)
+            return None
+    
+    async def _generate_tree_with_escalation(self, prompt: str, fast_timeout: float) -> str:
+        """
+        Ask the fast tree model first and return its JSON if it parses into a sane tree;
+        otherwise (bad JSON, failed sanity check or no answer within fast_timeout) ask the
+        escalation model and return its answer as-is. API errors, quota errors in particular,
+        are raised rather than escalated: _call_with_retry has already retried them, and a
+        second model would only spend more of the same quota.
+        """
+        try:
+            async with asyncio.timeout(fast_timeout):
+                response_text = await self._generate_tree_json(prompt, self.tree_model)
+            if _is_valid_tree(orjson.loads(response_text)):
+                self.tree_stats["fast"] += 1
+                return response_text
+            reason = "the tree failed the sanity check"
+        except (TimeoutError, httpx.TimeoutException):
+            reason = "it timed out"
+        except orjson.JSONDecodeError as e:
+            reason = f"its JSON didn't parse: {e}"
+        
+        self.tree_stats["escalated"] += 1
+        logger.info("Escalating tree generation to %s because %s (%s)", self.tree_escalation_model, reason, self.tree_stats)
+        return await self._generate_tree_json(prompt, self.tree_escalation_model)
+    
+    async def _generate_tree_json(self, prompt: str, model: str) -> str:
+        """
+        Ask the LLM for a knowledge tree and return the JSON text of its answer.
+        The static rules are sent as the system instruction and only the concept as the user turn.
+        Gemini models use JSON mode with a schema, so the output is always bare JSON;
+        other models (Gemma has no JSON mode or system instructions) get the rules folded
+        into the user turn and may surround the JSON with a code fence or prose, which is cut away.
+        """
+        if "gemini" in model:
+            response = await _call_with_retry(self._rate_limited(
+                model,
+                TREE_SYSTEM_PROMPT + prompt,
+                lambda: self.genai_client.aio.models.generate_content(
+                    model=model,
+                    contents=prompt,
+                    config=genai_types.GenerateContentConfig(
+                        system_instruction=TREE_SYSTEM_PROMPT,
+                        temperature=0.2,
+                        response_mime_type="application/json",
+                        response_json_schema=TREE_SCHEMA
+                    )
+                )
+            ))
+            # A blocked response has no text; parsing "" fails like any other bad JSON
+            return response.text or ""
+        
+        # Lower temperature than explanations for more reliable JSON
+        response_text = await self._generate_text(TREE_SYSTEM_PROMPT + "\n\n" + prompt, model=model, temperature=0.2)
+        return _extract_json(response_text)
+    
+    async def _generate_text(self, prompt: str, model: Optional[str] = None, temperature: float = 0.7) -> str:
+        """
+        Generate a complete (non-streamed) response and return its text, retrying transient errors.
+        """
+        model = model or self.model
+        response = await _call_with_retry(self._rate_limited(model, prompt, lambda: self.genai_client.aio.models.generate_content(
+            model=model,
+            contents=prompt,
+            config=genai_types.GenerateContentConfig(temperature=temperature)
+        )))
+        return response.text or ""
+    
+    def _rate_limited(self, model: str, prompt: str, make_call: Callable[[], Awaitable]) -> Callable[[], Awaitable]:
+        """
+        Wrap an API call so that every attempt, retries included, first waits for a free
+        slot under the model's rate limits.
+        """
+        tokens = estimate_tokens(prompt)
+        
+        async def call():
+            await self.rate_limiter.acquire(model, tokens)
+            return await make_call()
+        
+        return call
+    
     async def _find_wikipedia_images(self, concept_name: str, max_images: int = 3) -> Optional[List[Dict]]:
         """
         Find and extract relevant Wikipedia images for a concept.
-        Returns None if no images found.
+        Returns None if the page has no usable images; raises if the lookup itself fails.
         """
-        try:
-            # Find Wikipedia page title
-            page_title = concept_name.replace(' ', '_')
-            
-            # Extract images
-            results = await asyncio.to_thread(self.wiki_tool.extract_images_detailed, page_title)
+        # Find Wikipedia page title
+        page_title = concept_name.replace(' ', '_')
+        
+        # Extract images, reusing recent results for the same page
+        cache_key = make_cache_key("wiki_images", page_title=page_title)
+        images = self.cache.get(cache_key)
+        if images is None:
+            results = await self.wiki_tool.extract_images_detailed_async(page_title)
             images = results.get('images', [])
-            
-            if not images:
-                return None
-            
-            # Select best images using batch analysis
-            selected = await self._select_relevant_images(images, concept_name, max_images)
-            return selected if selected else None
-            
-        except Exception as e:
-            print(f"Error extracting Wikipedia images: {e}")
+            self.cache.set(cache_key, images, ttl=WIKI_IMAGES_TTL if images else WIKI_NO_IMAGES_TTL)
+        
+        if not images:
             return None
+        
+        # Select best images using batch analysis
+        selected = await self._select_relevant_images(images, concept_name, max_images)
+        return selected if selected else None
     
     async def _select_relevant_images(self, images: List[Dict], concept_name: str, max_images: int) -> Optional[List[Dict]]:
         """
         Select the most relevant images for explaining a concept using batch LLM analysis.
+        Concurrent selections for other concepts are merged into the same request.
+        Raises if the selection request fails.
         """
-        try:
-            # Prepare image data for batch analysis
-            images_data = []
-            for i, img in enumerate(images[:20]):  # Limit to first 20 to avoid token limits
-                images_data.append({
-                    'index': i,
-                    'caption': img['caption'][:200] if img['caption'] else 'No caption',
-                    'section_text': img.get('section_text', '')[:200] if img.get('section_text') else 'No context'
-                })
+        return await self.image_batcher.process((concept_name, images, max_images))
+    
+    async def _select_relevant_images_batch(self, jobs: List[tuple]) -> List[Optional[List[Dict]]]:
+        """
+        Choose images for several concepts with one LLM call.
+        
+        Args:
+            jobs: (concept_name, images, max_images) tuples
             
+        Returns:
+            The selected images (or None) for each job, in order
+        """
+        if len(jobs) == 1:
+            concept_name, images, max_images = jobs[0]
             prompt = f"""You are selecting images to help explain the concept "{concept_name}".
 
-Available images:
-{json.dumps(images_data, indent=2)}
+Available images ({IMAGE_CANDIDATE_LEGEND}):
+{orjson.dumps(_image_candidates(images)).decode()}
 
 Select FEWER THAN {max_images} images that would be MOST helpful for understanding "{concept_name}". 
 Choose only essential images that directly illustrate the concept.
@@ -240,170 +638,363 @@ Respond in JSON format:
 }}
 
 Return ONLY valid JSON, no extra text."""
-            
-            response = await asyncio.to_thread(
-                self.genai_client.models.generate_content,
-                model='models/gemma-3-27b-it',
-                contents=prompt
+        else:
+            blocks = "".join(
+                f"""
+Concept {concept_id}: "{concept_name}" (select FEWER THAN {max_images} images)
+Available images:
+{orjson.dumps(_image_candidates(images)).decode()}
+"""
+                for concept_id, (concept_name, images, max_images) in enumerate(jobs)
             )
-            
-            # Parse response
-            response_text = response.text.strip()
-            response_text = re.sub(r'^```(?:json)?\n', '', response_text)
-            response_text = re.sub(r'\n```$', '', response_text)
-            
-            result = json.loads(response_text)
-            
-            # Extract selected images
-            selected_images = []
-            for selection in result.get('selected_images', []):
-                idx = selection['index']
-                if 0 <= idx < len(images):
-                    img = images[idx].copy()
-                    img['reason'] = selection.get('reason', '')
-                    selected_images.append(img)
-            
-            return selected_images if selected_images else None
-            
-        except Exception as e:
-            print(f"Error selecting images: {e}")
-            return None
+            prompt = f"""You are selecting images to help explain several concepts.
+{IMAGE_CANDIDATE_LEGEND}
+{blocks}
+For each concept, select the images that would be MOST helpful for understanding it.
+Choose only essential images that directly illustrate the concept.
+
+Respond in JSON format:
+{{
+  "results": [
+    {{
+      "concept_id": 0,
+      "selected_images": [
+        {{
+          "index": 0,
+          "reason": "Brief reason why this image helps explain the concept"
+        }}
+      ]
+    }}
+  ]
+}}
+
+Return ONLY valid JSON, no extra text."""
+        
+        response = await _call_with_retry(self._rate_limited(IMAGE_SELECTION_MODEL, prompt, lambda: self.genai_client.aio.models.generate_content(
+            model=IMAGE_SELECTION_MODEL,
+            contents=prompt
+        )))
+        
+        # Parse response
+        response_text = _extract_json(response.text)
+        try:
+            result = orjson.loads(response_text)
+        except orjson.JSONDecodeError:
+            result = json_repair.loads(response_text)
+        
+        if len(jobs) == 1:
+            if not isinstance(result, dict):
+                raise ValueError(f"Image selection response is not a JSON object: {response_text[:200]!r}")
+            selections = {0: result.get('selected_images') or []}
+        else:
+            results = result.get('results') if isinstance(result, dict) else None
+            if not isinstance(results, list):
+                # One bad merged answer shouldn't cost every concept its images
+                logger.warning("Unusable image selection for %d concepts; selecting per concept", len(jobs))
+                return await self._select_images_per_concept(jobs)
+            selections = {}
+            for item in results:
+                concept_id = _as_int(item.get('concept_id')) if isinstance(item, dict) else None
+                if concept_id is not None:
+                    selections[concept_id] = item.get('selected_images') or []
+        return [_pick_images(images, selections.get(concept_id, []))
+                for concept_id, (_, images, _) in enumerate(jobs)]
     
-    async def explain_concept(self, concept_name: str, original_query: str, knowledge_tree: dict, use_images: bool = True, max_images: int = 3) -> str:
+    async def _select_images_per_concept(self, jobs: List[tuple]) -> List:
+        """
+        Fallback for _select_relevant_images_batch: one selection request per concept, run
+        concurrently. A concept whose request fails gets its exception as its result.
         """
-        Generate a detailed explanation for a specific concept, optionally with Wikipedia images.
+        results = await asyncio.gather(*(self._select_relevant_images_batch([job]) for job in jobs), return_exceptions=True)
+        return [result if isinstance(result, BaseException) else result[0] for result in results]
+    
+    async def _stream_llm(self, prompt: str, timeout: float, cached_content: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Stream the LLM response text chunk by chunk over the shared HTTP/2 pool.
+        The timeout bounds the whole generation, not each chunk. The request is only sent
+        when the first chunk is awaited, so opening the stream and receiving its first
+        chunk are retried together on transient errors; a stream that already produced
+        text is not. Raises TimeoutError if the deadline is hit.
         
         Args:
-            concept_name: The concept to explain
-            original_query: The original learning goal
-            knowledge_tree: The full knowledge tree context
-            use_images: Whether to try to include Wikipedia images (default: True)
-            max_images: Maximum number of images to include (default: 3)
+            prompt: The prompt, or only its new part when cached_content is given
+            timeout: Seconds allowed for the whole response
+            cached_content: Name of a Gemini cached content the prompt continues
         """
-        # Try to find relevant Wikipedia images if requested
-        selected_images = None
-        if use_images:
+        deadline = asyncio.get_running_loop().time() + timeout
+        config = genai_types.GenerateContentConfig(temperature=0.7, cached_content=cached_content)
+        
+        async def open_stream():
+            stream = await self.genai_client.aio.models.generate_content_stream(
+                model=self.model,
+                contents=prompt,
+                config=config
+            )
             try:
-                selected_images = await self._find_wikipedia_images(concept_name, max_images)
-            except Exception as e:
-                print(f"Could not load images for {concept_name}: {e}")
-                selected_images = None
+                return stream, await stream.__anext__()
+            except StopAsyncIteration:
+                return stream, None
+            except BaseException:
+                await stream.aclose()
+                raise
         
-        # Build the prompt
-        prompt = f"""You are an expert educator explaining concepts in a clear, detailed manner.
-
-Original Learning Goal: "{original_query}"
-
-Full Knowledge Map Context:
-{json.dumps(knowledge_tree, indent=2)}
-
-Now, provide a detailed explanation specifically for this concept: "{concept_name}"
-"""
+        async with asyncio.timeout_at(deadline):
+            stream, chunk = await _call_with_retry(self._rate_limited(self.model, prompt, open_stream))
+        try:
+            while chunk is not None:
+                if chunk.text:
+                    yield chunk.text
+                try:
+                    async with asyncio.timeout_at(deadline):
+                        chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    return
+        finally:
+            await stream.aclose()
+    
+    def _build_explain_prompt(self, concept_name: str, original_query: str, knowledge_tree: dict, selected_images: Optional[List[Dict]] = None) -> str:
+        """
+        Build the prompt for explaining a concept, optionally referencing Wikipedia images.
+        Only the concept's path from the root and its direct children are sent as context;
+        the whole tree, cut to its top levels if it's large, is used if the concept can't be found in it.
+        """
+        tree_outline = concept_path_outline(knowledge_tree, concept_name) or bounded_tree_outline(knowledge_tree, MAX_OUTLINE_TOKENS)
+        parts = [EXPLAIN_PROMPT_HEADER.format(
+            original_query=original_query,
+            tree_outline="\n".join(tree_outline),
+            concept_name=concept_name
+        )]
         
         # Add image information if available
         if selected_images:
-            prompt += f"""
-Available illustrations from Wikipedia (use these strategically in your explanation):
-"""
-            for i, img in enumerate(selected_images):
-                prompt += f"""
-Image {i}:
-- Caption: {img['caption'][:150]}
-- Why relevant: {img.get('reason', 'Illustrates the concept')}
-"""
-            prompt += """
-**ABSOLUTELY CRITICAL - IMAGE REFERENCE FORMAT:**
-
-CORRECT way to show images:
-✓ "The visual proof [IMG:0] demonstrates this concept."
-✓ "Consider the animation below:\n\n[IMG:1]\n\nThis shows..."
-
-WRONG - DO NOT DO THIS:
-✗ ![caption](URL)
-✗ (https://upload.wikimedia.org/...)
-✗ ![Image](IMAGE_0)
-✗ Any URL or markdown syntax
-
-YOU MUST ONLY USE: [IMG:0], [IMG:1], [IMG:2]
-Do not write ANY URLs. Do not write ANY markdown image syntax.
-ONLY write [IMG:X] where X is the image number.
-"""
+            parts.append(EXPLAIN_IMAGES_HEADER)
+            parts.extend(
+                EXPLAIN_IMAGE_ITEM.format(
+                    index=i,
+                    caption=img['caption'][:150],
+                    reason=img.get('reason', 'Illustrates the concept')
+                )
+                for i, img in enumerate(selected_images)
+            )
+            parts.append(EXPLAIN_IMAGE_FORMAT_RULES)
         
-        prompt += f"""
-Your explanation should:
-1. Focus ONLY on explaining "{concept_name}" in detail
-2. Be aware of the context (the original goal was "{original_query}")
-3. Explain what {concept_name} is, why it matters in the context of learning {original_query}
-4. Provide 2-3 concrete examples or applications
-5. If relevant, briefly mention how it connects to the broader learning path
-6. Keep the explanation clear, educational, and accessible
-7. Use markdown formatting for better readability
-"""
+        parts.append(EXPLAIN_GUIDELINES.format(concept_name=concept_name, original_query=original_query))
+        parts.append(EXPLAIN_GUIDELINES_WITH_IMAGES if selected_images else EXPLAIN_GUIDELINES_WITHOUT_IMAGES)
+        parts.append(EXPLAIN_PROMPT_FOOTER.format(concept_name=concept_name))
+        # Concatenate once instead of copying the growing prompt on every +=
+        return "".join(parts)
+    
+    async def _load_images(self, concept_name: str, max_images: int) -> Tuple[Optional[List[Dict]], bool]:
+        """
+        Find images for an explanation, giving up after IMAGE_LOOKUP_TIMEOUT seconds.
+        Returns (images, complete): images is None if there are none to show, and complete
+        is False when the lookup failed or timed out, so the explanation shouldn't be cached.
+        """
+        try:
+            async with asyncio.timeout(IMAGE_LOOKUP_TIMEOUT):
+                return await self._find_wikipedia_images(concept_name, max_images), True
+        except TimeoutError:
+            logger.warning("Image lookup for %s timed out, explaining without images", concept_name)
+        except Exception:
+            logger.exception("Could not load images for %s", concept_name)
+        return None, False
+    
+    async def explain_concept(self, concept_name: str, original_query: str, knowledge_tree: dict, use_images: bool = True, max_images: int = 3) -> AsyncIterator:
+        """
+        Stream a detailed explanation for a specific concept, optionally with Wikipedia images.
+        Yields markdown chunks as they are generated. On failure an {"error": kind} event
+        is yielded first, followed by a markdown message for the user.
         
-        if selected_images:
-            prompt += f"""8. **Include the provided images** where they help illustrate your explanation using [IMG:0], [IMG:1], etc.
-9. **IMPORTANT: For any mathematical formulas or equations, use LaTeX notation:**
-   - For inline math, use single dollar signs: $x^2 + y^2 = z^2$
-   - For display math (centered equations), use double dollar signs: $$E = mc^2$$
-   - Example: "The quadratic formula is $x = \\frac{{-b \\pm \\sqrt{{b^2 - 4ac}}}}{{2a}}$"
-10. Aim for 3-5 paragraphs with images integrated naturally
-"""
-        else:
-            prompt += f"""8. **IMPORTANT: For any mathematical formulas or equations, use LaTeX notation:**
-   - For inline math, use single dollar signs: $x^2 + y^2 = z^2$
-   - For display math (centered equations), use double dollar signs: $$E = mc^2$$
-   - Example: "The quadratic formula is $x = \\frac{{-b \\pm \\sqrt{{b^2 - 4ac}}}}{{2a}}$"
-9. Aim for 3-5 paragraphs
-"""
+        Args:
+            concept_name: The concept to explain
+            original_query: The original learning goal
+            knowledge_tree: The full knowledge tree context
+            use_images: Whether to try to include Wikipedia images (default: True)
+            max_images: Maximum number of images to include (default: 3)
+        """
+        cache_key = make_cache_key(
+            "explain",
+            concept_name=concept_name,
+            original_query=original_query,
+            knowledge_tree=knowledge_tree,
+            use_images=use_images,
+            max_images=max_images
+        )
+        cached_explanation = self.cache.get(cache_key)
+        if cached_explanation is not None:
+            yield cached_explanation
+            return
         
-        prompt += f"\nProvide a focused, comprehensive explanation of: {concept_name}"
-
+        # Try to find relevant Wikipedia images if requested
+        selected_images, images_complete = await self._load_images(concept_name, max_images) if use_images else (None, True)
+        
+        # Convert [IMG:X] references to markdown image syntax with correct URLs as text streams in
+        image_filter = ImageReferenceFilter(selected_images) if selected_images else None
+        parts = []
         try:
-            # Use asyncio.wait_for to enforce a hard timeout
-            response = await asyncio.wait_for(
-                asyncio.to_thread(self.llm.invoke, prompt),
-                timeout=30.0  # Hard timeout of 30 seconds for explanation
-            )
-            explanation = response.content if hasattr(response, 'content') else str(response)
-            explanation = explanation.strip()
-            
-            # Convert [IMG:X] references to markdown image syntax with correct URLs
-            if selected_images:
-                # Remove any lines containing Wikipedia URLs (LLM sometimes ignores instructions)
-                lines = explanation.split('\n')
-                cleaned_lines = []
-                for line in lines:
-                    if 'upload.wikimedia.org' not in line.lower():
-                        cleaned_lines.append(line)
-                explanation = '\n'.join(cleaned_lines)
-                
-                # Convert [IMG:X] references to proper markdown
-                for i, img in enumerate(selected_images):
-                    reference = f'[IMG:{i}]'
-                    caption = img['caption'][:100] if img['caption'] else f"Image {i}"
-                    url = img['url']
-                    markdown_image = f"\n\n![{caption}]({url})\n\n"
-                    explanation = explanation.replace(reference, markdown_image)
-                
-                # Clean up extra whitespace
-                explanation = re.sub(r'\n{3,}', '\n\n', explanation)
+            # Built inside the try so a malformed client tree still ends in an error event
+            prompt = self._build_explain_prompt(concept_name, original_query, knowledge_tree, selected_images)
+            async for text in self._stream_llm(prompt, timeout=30.0):  # Hard timeout of 30 seconds for explanation
+                if image_filter:
+                    text = image_filter.feed(text)
+                elif not parts:
+                    text = text.lstrip()
+                if text:
+                    parts.append(text)
+                    yield text
+            if image_filter:
+                text = image_filter.flush()
+                if text:
+                    parts.append(text)
+                    yield text
             
-            return explanation
+            explanation = "".join(parts).strip()
+            # Don't pin an image-less explanation for a day because of a temporary lookup failure
+            if explanation and images_complete:
+                self.cache.set(cache_key, explanation)
             
-        except asyncio.TimeoutError:
-            print("Explanation request timed out")
-            return "⚠️ **Request Timed Out**\n\nThe request took too long. This might be due to API rate limits. Please try again in a moment."
+        except TimeoutError:
+            logger.warning("Explanation request timed out")
+            yield {"error": "timeout"}
+            yield "⚠️ **Request Timed Out**\n\nThe request took too long. This might be due to API rate limits. Please try again in a moment."
         except Exception as e:
-            error_str = str(e)
-            print(f"Error generating explanation: {e}")
+            error_kind = _classify_error(e)
+            logger.exception("Error generating explanation")
+            yield {"error": error_kind}
             
             # Check if it's a quota error - return immediately
-            if "quota" in error_str.lower() or "429" in error_str or "ResourceExhausted" in error_str or "Quota exceeded" in error_str:
-                return "⚠️ **API Quota Exceeded**\n\nThe API quota limit has been reached. Please try again later or check your API plan and billing details.\n\nFor more information, visit: https://ai.google.dev/gemini-api/docs/rate-limits"
+            if error_kind == "quota":
+                yield "⚠️ **API Quota Exceeded**\n\nThe API quota limit has been reached. Please try again later or check your API plan and billing details.\n\nFor more information, visit: https://ai.google.dev/gemini-api/docs/rate-limits"
+                return
             
-            return f"Error generating explanation for {concept_name}: {str(e)}"
+            yield f"Error generating explanation for {concept_name}: {str(e)}"
     
-    async def chat_about_explanation(
+    async def explain_concepts_batch(
+        self,
+        concept_names: List[str],
+        original_query: str,
+        knowledge_tree: dict,
+        use_images: bool = False,
+        max_images: int = 3
+    ) -> Dict:
+        """
+        Generate explanations for several concepts at once (e.g. a whole subtree).
+        Cached explanations are reused; the rest (including their image lookups) run
+        concurrently, at most EXPLAIN_BATCH_CONCURRENCY at a time across all batches.
+        
+        Args:
+            concept_names: The concepts to explain
+            original_query: The original learning goal
+            knowledge_tree: The full knowledge tree context
+            use_images: Whether to try to include Wikipedia images (default: False)
+            max_images: Maximum number of images per explanation (default: 3), clamped
+                to EXPLAIN_BATCH_MAX_IMAGES
+            
+        Returns:
+            {"explanations": {name: markdown}, "errors": {name: error kind}}
+        """
+        max_images = min(max(max_images, 0), EXPLAIN_BATCH_MAX_IMAGES)
+        explanations = {}
+        errors = {}
+        pending = []
+        for concept_name in dict.fromkeys(concept_names):  # Drop duplicates, keep order
+            # Same key as explain_concept, so both paths share results
+            cache_key = make_cache_key(
+                "explain",
+                concept_name=concept_name,
+                original_query=original_query,
+                knowledge_tree=knowledge_tree,
+                use_images=use_images,
+                max_images=max_images
+            )
+            cached_explanation = self.cache.get(cache_key)
+            if cached_explanation is not None:
+                explanations[concept_name] = cached_explanation
+            else:
+                pending.append((concept_name, cache_key))
+        
+        if not pending:
+            return {"explanations": explanations, "errors": errors}
+        
+        async def explain(concept_name: str) -> Tuple[str, bool]:
+            async with self._explain_semaphore:
+                selected_images, images_complete = await self._load_images(concept_name, max_images) if use_images else (None, True)
+                prompt = self._build_explain_prompt(concept_name, original_query, knowledge_tree, selected_images)
+                text = await self._generate_text(prompt)
+            if not selected_images:
+                return text.strip(), images_complete
+            image_filter = ImageReferenceFilter(selected_images)
+            return (image_filter.feed(text) + image_filter.flush()).strip(), images_complete
+        
+        # Hard timeout of 60 seconds for the whole batch; explanations finished by then are
+        # kept (and cached), only the unfinished ones are cancelled and reported. If the
+        # request itself is cancelled (e.g. the client went away), every task is cancelled.
+        tasks = [asyncio.create_task(explain(name)) for name, _ in pending]
+        unfinished = set(tasks)
+        try:
+            _, unfinished = await asyncio.wait(tasks, timeout=EXPLAIN_BATCH_TIMEOUT)
+        finally:
+            if unfinished:
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        if unfinished:
+            logger.warning("Batch explanation timed out for %d of %d concepts", len(unfinished), len(tasks))
+        
+        for (concept_name, cache_key), task in zip(pending, tasks):
+            if task in unfinished:
+                response = TimeoutError()
+            else:
+                response = task.exception() or task.result()
+            if isinstance(response, BaseException):
+                logger.warning("Error generating explanation for %s: %s", concept_name, response)
+                errors[concept_name] = "timeout" if isinstance(response, TimeoutError) else _classify_error(response)
+                continue
+            explanation, images_complete = response
+            explanations[concept_name] = explanation
+            if explanation and images_complete:
+                self.cache.set(cache_key, explanation)
+        
+        return {"explanations": explanations, "errors": errors}
+    
+    def _build_chat_prefix(self, concept_name: str, original_query: str, knowledge_tree: dict, explanation: str) -> str:
+        """
+        Build the part of the chat prompt that stays the same for every turn about an explanation.
+        As for explanations, only the concept's path from the root and its children are included,
+        and a very long explanation is clipped to keep the prompt within budget.
+        """
+        tree_outline = concept_path_outline(knowledge_tree, concept_name) or bounded_tree_outline(knowledge_tree, MAX_OUTLINE_TOKENS)
+        return CHAT_PROMPT_HEADER.format(
+            original_query=original_query,
+            concept_name=concept_name,
+            tree_outline="\n".join(tree_outline),
+            explanation=clip_text(explanation, MAX_EXPLANATION_TOKENS)
+        )
+    
+    def _build_chat_suffix(self, chat_history: list, user_message: str) -> str:
+        """
+        Build the per-turn part of the chat prompt: recent history plus the current question.
+        Older chat turns are trimmed to keep the prompt within budget; a long question
+        is clipped and leaves correspondingly less room for history.
+        """
+        parts = []
+        user_message = clip_text(user_message, MAX_QUESTION_TOKENS)
+        
+        # Add chat history
+        history_budget = MAX_TURN_TOKENS - estimate_tokens(user_message)
+        chat_history = trim_chat_history(chat_history, max_tokens=history_budget)
+        if chat_history:
+            parts.append("CONVERSATION HISTORY:\n")
+            for msg in chat_history:
+                role = "Student" if msg["role"] == "user" else "Tutor"
+                parts.append(f"{role}: {msg['content']}\n")
+            parts.append("\n")
+        
+        # Add current question
+        parts.append(CHAT_PROMPT_FOOTER.format(user_message=user_message))
+        return "".join(parts)
+    
+    def _build_chat_prompt(
         self, 
         concept_name: str, 
         original_query: str, 
@@ -412,10 +1003,85 @@ Your explanation should:
         chat_history: list,
         user_message: str
     ) -> str:
+        """
+        Build the context-aware prompt for a follow-up question about an explanation.
+        """
+        return (
+            self._build_chat_prefix(concept_name, original_query, knowledge_tree, explanation)
+            + self._build_chat_suffix(chat_history, user_message)
+        )
+    
+    async def _create_context_cache(self, prefix: str) -> Optional[str]:
+        """
+        Upload a static prompt prefix as Gemini cached content so later turns only send the new part.
+        Returns the cached content name, or None if caching isn't available for this prompt
+        or the upload takes longer than CONTEXT_CACHE_TIMEOUT seconds.
+        """
+        # Gemma models don't support context caching, and Gemini rejects caches below a minimum size
+        if "gemini" not in self.model or estimate_tokens(prefix) < CONTEXT_CACHE_MIN_TOKENS:
+            return None
+        
+        try:
+            async with asyncio.timeout(CONTEXT_CACHE_TIMEOUT):
+                cached = await self.genai_client.aio.caches.create(
+                    model=self.model,
+                    config=genai_types.CreateCachedContentConfig(contents=prefix, ttl=CONTEXT_CACHE_TTL)
+                )
+            return cached.name
+        except TimeoutError:
+            logger.warning("Context cache creation timed out, sending the full prompt")
+            return None
+        except Exception as e:
+            logger.warning("Could not create context cache: %s", e)
+            return None
+    
+    async def _stream_chat(self, build_prefix: Callable[[], str], suffix: str, cached_content: Optional[str], timeout: float) -> AsyncIterator[str]:
+        """
+        Stream a chat response, reusing the cached prefix when available.
+        Falls back to sending the full prompt if the cache can't be used (e.g. it expired);
+        the prefix is only built in that case, so cached turns never re-serialize the context.
+        The timeout covers both attempts together.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        if cached_content:
+            produced = False
+            try:
+                async for text in self._stream_llm(suffix, timeout, cached_content=cached_content):
+                    produced = True
+                    yield text
+                return
+            except TimeoutError:
+                raise
+            except Exception as e:
+                if produced:
+                    raise
+                logger.warning("Context cache %s unavailable, sending the full prompt: %s", cached_content, e)
+        
+        async for text in self._stream_llm(build_prefix() + suffix, deadline - loop.time()):
+            yield text
+    
+    async def chat_about_explanation(
+        self, 
+        concept_name: str, 
+        original_query: str, 
+        knowledge_tree: dict, 
+        explanation: str,
+        chat_history: list,
+        user_message: str,
+        cached_content: Optional[str] = None
+    ) -> AsyncIterator:
         """
         Handle chat messages about a concept explanation with full context.
         Maintains the conversation history for follow-up questions.
         
+        Failures are reported like in explain_concept: an {"error": kind} event, then a message.
+        
+        The static context (tree + explanation) is uploaded once as Gemini cached content when
+        the model supports it; its name is yielded as {"cached_content": name} so the client
+        can send it back with the next message, and later turns only send history + question.
+        Names this server didn't issue for the same context are ignored.
+        
         Args:
             concept_name: The concept being discussed
             original_query: The user's original learning goal
@@ -423,89 +1089,134 @@ Your explanation should:
             explanation: The initial explanation provided
             chat_history: Previous chat messages [{"role": "user"/"assistant", "content": "..."}]
             user_message: The current user question
+            cached_content: Name of the cached context from an earlier turn, if any
             
-        Returns:
-            AI response to the user's question
+        Yields:
+            Chunks of the AI response to the user's question
         """
-        # Build context-aware prompt
-        context = f"""You are an expert tutor helping a student understand concepts.
-
-CONTEXT:
-- Original Learning Goal: "{original_query}"
-- Current Concept Being Discussed: "{concept_name}"
-- Knowledge Map Context: {json.dumps(knowledge_tree, indent=2)}
-
-INITIAL EXPLANATION PROVIDED:
-{explanation}
-
-"""
+        prefix = None
         
-        # Add chat history
-        if chat_history:
-            context += "CONVERSATION HISTORY:\n"
-            for msg in chat_history:
-                role = "Student" if msg["role"] == "user" else "Tutor"
-                context += f"{role}: {msg['content']}\n"
-            context += "\n"
+        def build_prefix() -> str:
+            nonlocal prefix
+            if prefix is None:
+                prefix = self._build_chat_prefix(concept_name, original_query, knowledge_tree, explanation)
+            return prefix
         
-        # Add current question
-        context += f"""CURRENT STUDENT QUESTION:
-{user_message}
-
-INSTRUCTIONS:
-- Answer the student's question clearly and concisely
-- Reference the explanation and context when relevant
-- Use markdown formatting for better readability
-- For any mathematical formulas, use LaTeX notation ($...$ for inline, $$...$$ for display)
-- Be encouraging and educational
-- If the question is off-topic, gently redirect to the current concept
-- Keep responses focused and not too long
-
-Provide your response:"""
-
+        started = False
         try:
-            # Use asyncio.wait_for to enforce a hard timeout
-            response = await asyncio.wait_for(
-                asyncio.to_thread(self.llm.invoke, context),
-                timeout=15.0  # Hard timeout of 15 seconds
+            # Built inside the try so a malformed client tree or history still ends in an error event
+            suffix = self._build_chat_suffix(chat_history, user_message)
+            
+            # Cache names come from the client, so only continue a cache this server created
+            # for exactly this conversation context; anything else could be another user's
+            context_key = make_cache_key(
+                "chat_context",
+                model=self.model,
+                concept_name=concept_name,
+                original_query=original_query,
+                knowledge_tree=knowledge_tree,
+                explanation=explanation
             )
-            answer = response.content if hasattr(response, 'content') else str(response)
-            return answer.strip()
-        except asyncio.TimeoutError:
-            print("Chat request timed out")
-            return "⚠️ **Request Timed Out**\n\nThe request took too long. This might be due to API rate limits. Please try again in a moment."
+            issued_key = make_cache_key("context_cache", name=cached_content)
+            if cached_content and self.cache.get(issued_key) != context_key:
+                logger.warning("Ignoring context cache %s, which wasn't issued for this conversation", cached_content)
+                cached_content = None
+            
+            if not cached_content:
+                cached_content = await self._create_context_cache(build_prefix())
+                if cached_content:
+                    self.cache.set(
+                        make_cache_key("context_cache", name=cached_content),
+                        context_key,
+                        ttl=CONTEXT_CACHE_TTL_SECONDS
+                    )
+                    yield {"cached_content": cached_content}
+            
+            async for text in self._stream_chat(build_prefix, suffix, cached_content, timeout=15.0):  # Hard timeout of 15 seconds
+                if not started:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    started = True
+                yield text
+        except TimeoutError:
+            logger.warning("Chat request timed out")
+            yield {"error": "timeout"}
+            yield "⚠️ **Request Timed Out**\n\nThe request took too long. This might be due to API rate limits. Please try again in a moment."
         except Exception as e:
-            error_str = str(e)
-            print(f"Error in chat about explanation: {e}")
+            error_kind = _classify_error(e)
+            logger.exception("Error in chat about explanation")
+            yield {"error": error_kind}
             
             # Check if it's a quota error - return immediately
-            if "quota" in error_str.lower() or "429" in error_str or "ResourceExhausted" in error_str or "Quota exceeded" in error_str:
-                return "⚠️ **API Quota Exceeded**\n\nThe API quota limit has been reached. Please try again later or check your API plan.\n\nFor more information, visit: https://ai.google.dev/gemini-api/docs/rate-limits"
+            if error_kind == "quota":
+                yield "⚠️ **API Quota Exceeded**\n\nThe API quota limit has been reached. Please try again later or check your API plan.\n\nFor more information, visit: https://ai.google.dev/gemini-api/docs/rate-limits"
+                return
             
             # Check for rate limit errors
-            if "rate limit" in error_str.lower() or "too many requests" in error_str.lower():
-                return "⚠️ **Rate Limit Exceeded**\n\nToo many requests. Please wait a moment and try again."
+            if error_kind == "rate_limit":
+                yield "⚠️ **Rate Limit Exceeded**\n\nToo many requests. Please wait a moment and try again."
+                return
             
-            return f"I apologize, but I encountered an error processing your question. Please try again."
+            yield "I apologize, but I encountered an error processing your question. Please try again."
     
-    def list_models(self):
-        """List all available models and their supported methods."""
-        try:
-            for model in genai.list_models():
-                print(f"\nModel: {model.name}")
-                print(f"Display name: {model.display_name}")
-                print(f"Description: {model.description}")
-                print(f"Generation methods: {model.supported_generation_methods}")
-                print("-" * 50)
-        except Exception as e:
-            print(f"Error listing models: {str(e)}")
+    async def warmup(self, timeout: float = 5.0):
+        """
+        Prepare for the first request: load cached results and the concept embedding index
+        from disk, and open the pooled connections to the Gemini API (with a cheap token-count
+        call) and to Wikipedia (with a HEAD request) at the same time, so the first request
+        doesn't pay for the TLS handshakes. Connection failures are only logged.
+        """
+        await self.cache.start()
+        index_state = self.cache.get(TREE_INDEX_KEY)
+        if index_state is not None:
+            self.tree_index.load_state(index_state)
+        
+        async def ping(name: str, make_call: Callable[[], Awaitable]):
+            try:
+                async with asyncio.timeout(timeout):
+                    await make_call()
+            except Exception as e:
+                logger.warning("%s warmup failed: %s", name, e)
+        
+        await asyncio.gather(
+            ping("LLM", lambda: self.genai_client.aio.models.count_tokens(model=self.model, contents="ping")),
+            ping("Wikipedia", lambda: self.http_client.head(self.wiki_tool.BASE_URL, headers=self.wiki_tool.HEADERS))
+        )
+    
+    async def aclose(self):
+        """Save the embedding index, flush the cache and close the HTTP clients."""
+        if len(self.tree_index):
+            # Every worker keeps its own index; merge into the saved one instead of
+            # overwriting what the other workers added
+            def merge_index(saved_state):
+                if saved_state is not None:
+                    self.tree_index.merge_state(saved_state)
+                return self.tree_index.to_state()
+            await asyncio.to_thread(self.cache.merge, TREE_INDEX_KEY, merge_index)
+        await self.cache.aclose()
+        self.wiki_tool.close()
+        await self.http_client.aclose()
 
 
-# Create a singleton instance (will be overridden if model is specified)
-llm_service = LLMService()
+def list_models():
+    """List all available models and their supported methods."""
+    try:
+        client = google_genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+        for model in client.models.list():
+            print(f"\nModel: {model.name}")
+            print(f"Display name: {model.display_name}")
+            print(f"Description: {model.description}")
+            print(f"Generation methods: {model.supported_actions}")
+            print("-" * 50)
+    except Exception as e:
+        print(f"Error listing models: {str(e)}")
 
 
 if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     parser = argparse.ArgumentParser(description="LLM Service CLI")
     parser.add_argument(
         "-l", "--list-models",
@@ -527,15 +1238,13 @@ if __name__ == "__main__":
     args = parser.parse_args()
     
     if args.list_models:
-        # Use a temporary service instance for listing models
-        temp_service = LLMService(model=args.model)
-        temp_service.list_models()
+        # Listing models only needs the API key, not a full service
+        list_models()
     elif args.test:
         # Create service with specified model
         test_service = LLMService(model=args.model)
         print(f"Using model: {args.model}")
-        response = test_service.llm.invoke("Hello, how are you?")
-        response_text = response.content if hasattr(response, 'content') else str(response)
+        response_text = asyncio.run(test_service._generate_text("Hello, how are you?"))
         print(f"\nResponse: {response_text}")
     else:
         parser.print_help()
\ No newline at end of file
@@ -0,0 +1,307 @@
+from typing import List, Optional
+
+# Prompt templates are built once at import time and filled in per request with str.format.
+# Literal braces in the templates are doubled ({{ }}) so they survive formatting.
+
+# The static part of the tree prompt goes in the system instruction, and only the concept
+# changes per request. It has no placeholders, so its braces are written as-is.
+TREE_SYSTEM_PROMPT = """You are a knowledge mapping expert. Create a comprehensive learning dependency tree for the concept the student asks about.
+
+IMPORTANT CONCEPTS:
+- **Atomic Concept**: A fundamental, indivisible concept that can be learned in 5-15 minutes (leaf nodes with no children)
+- **Composite Concept**: A higher-level concept that requires understanding multiple atomic concepts (non-leaf nodes with children)
+
+Please structure your response as a JSON object with the following format:
+{
+  "name": "Main Concept",
+  "description": "Brief description of the concept",
+  "selfLearningTime": 10,
+  "children": [
+    {
+      "name": "Prerequisite 1 (Composite)",
+      "description": "Brief description",
+      "selfLearningTime": 8,
+      "children": [
+        {
+          "name": "Sub-prerequisite 1.1 (Atomic)",
+          "description": "Brief description",
+          "selfLearningTime": 12,
+          "children": []
+        }
+      ]
+    },
+    {
+      "name": "Prerequisite 2 (Atomic)",
+      "description": "Brief description",
+      "selfLearningTime": 7,
+      "children": []
+    }
+  ]
+}
+
+Rules:
+1. The root should be the main concept the student asks about
+2. Children should be prerequisites or foundational knowledge needed to understand the parent
+3. Each node MUST have: "name", "description", "selfLearningTime" (in minutes), and "children" fields
+4. **ATOMIC CONCEPTS (Leaf nodes):**
+   - Must have NO children (empty children array)
+   - Must be truly indivisible, basic concepts
+   - selfLearningTime should be between 5-15 minutes
+   - Examples: "Number", "Addition", "Subtraction"
+5. **COMPOSITE CONCEPTS (Non-leaf nodes):**
+   - Must have at least one child
+   - Represent concepts that combine multiple atomic concepts
+   - selfLearningTime is the time to understand the concept itself (5-15 min), not including children
+   - Examples broken down: "Vector Addition" → ["Vector", "Addition"]
+6. DO NOT use broad field or subjectnames such as "Linear Algebra" or "Calculus" as composite or atomic concepts
+7. Expand composite concepts deeply - ensure leaf nodes are truly atomic and basic
+8. If a concept seems too complex for 5-15 minutes, it's composite - break it down further
+9. Focus on the logical learning path from fundamentals to advanced
+10. Estimate selfLearningTime realistically based on concept complexity (always 5-15 minutes)
+11. IMPORTANT: Return ONLY valid JSON, no markdown formatting, no extra text"""
+
+TREE_USER_PROMPT = 'Generate the knowledge dependency tree for: "{concept}"'
+
+
+# Appended to TREE_USER_PROMPT to have the model explain the top of the tree in the same call
+TREE_SEED_EXPLANATIONS = """
+
+Also, for every node at depth {seed_depth} or less (the root is depth 0), add an "explanation" field:
+a clear 2-3 paragraph markdown explanation of that concept for a learner, using LaTeX ($...$) for any math.
+Deeper nodes must NOT have an "explanation" field."""
+
+
+EXPLAIN_PROMPT_HEADER = """You are an expert educator explaining concepts in a clear, detailed manner.
+
+Original Learning Goal: "{original_query}"
+
+Knowledge Map Context:
+{tree_outline}
+
+Now, provide a detailed explanation specifically for this concept: "{concept_name}"
+"""
+
+EXPLAIN_IMAGES_HEADER = """
+Available illustrations from Wikipedia (use these strategically in your explanation):
+"""
+
+EXPLAIN_IMAGE_ITEM = """
+Image {index}:
+- Caption: {caption}
+- Why relevant: {reason}
+"""
+
+EXPLAIN_IMAGE_FORMAT_RULES = """
+**ABSOLUTELY CRITICAL - IMAGE REFERENCE FORMAT:**
+
+CORRECT way to show images:
+✓ "The visual proof [IMG:0] demonstrates this concept."
+✓ "Consider the animation below:\n\n[IMG:1]\n\nThis shows..."
+
+WRONG - DO NOT DO THIS:
+✗ ![caption](URL)
+✗ (https://upload.wikimedia.org/...)
+✗ ![Image](IMAGE_0)
+✗ Any URL or markdown syntax
+
+YOU MUST ONLY USE: [IMG:0], [IMG:1], [IMG:2]
+Do not write ANY URLs. Do not write ANY markdown image syntax.
+ONLY write [IMG:X] where X is the image number.
+"""
+
+EXPLAIN_GUIDELINES = """
+Your explanation should:
+1. Focus ONLY on explaining "{concept_name}" in detail
+2. Be aware of the context (the original goal was "{original_query}")
+3. Explain what {concept_name} is, why it matters in the context of learning {original_query}
+4. Provide 2-3 concrete examples or applications
+5. If relevant, briefly mention how it connects to the broader learning path
+6. Keep the explanation clear, educational, and accessible
+7. Use markdown formatting for better readability
+"""
+
+# These two blocks contain no placeholders, so their braces are written as-is
+EXPLAIN_GUIDELINES_WITH_IMAGES = """8. **Include the provided images** where they help illustrate your explanation using [IMG:0], [IMG:1], etc.
+9. **IMPORTANT: For any mathematical formulas or equations, use LaTeX notation:**
+   - For inline math, use single dollar signs: $x^2 + y^2 = z^2$
+   - For display math (centered equations), use double dollar signs: $$E = mc^2$$
+   - Example: "The quadratic formula is $x = \\frac{-b \\pm \\sqrt{b^2 - 4ac}}{2a}$"
+10. Aim for 3-5 paragraphs with images integrated naturally
+"""
+
+EXPLAIN_GUIDELINES_WITHOUT_IMAGES = """8. **IMPORTANT: For any mathematical formulas or equations, use LaTeX notation:**
+   - For inline math, use single dollar signs: $x^2 + y^2 = z^2$
+   - For display math (centered equations), use double dollar signs: $$E = mc^2$$
+   - Example: "The quadratic formula is $x = \\frac{-b \\pm \\sqrt{b^2 - 4ac}}{2a}$"
+9. Aim for 3-5 paragraphs
+"""
+
+EXPLAIN_PROMPT_FOOTER = "\nProvide a focused, comprehensive explanation of: {concept_name}"
+
+CHAT_PROMPT_HEADER = """You are an expert tutor helping a student understand concepts.
+
+CONTEXT:
+- Original Learning Goal: "{original_query}"
+- Current Concept Being Discussed: "{concept_name}"
+- Knowledge Map Context:
+{tree_outline}
+
+INITIAL EXPLANATION PROVIDED:
+{explanation}
+
+"""
+
+CHAT_PROMPT_FOOTER = """CURRENT STUDENT QUESTION:
+{user_message}
+
+INSTRUCTIONS:
+- Answer the student's question clearly and concisely
+- Reference the explanation and context when relevant
+- Use markdown formatting for better readability
+- For any mathematical formulas, use LaTeX notation ($...$ for inline, $$...$$ for display)
+- Be encouraging and educational
+- If the question is off-topic, gently redirect to the current concept
+- Keep responses focused and not too long
+
+Provide your response:"""
+
+
+def _outline_line(node: dict, depth: int) -> str:
+    """
+    One outline line for a node; trees come from the client, so fields may be null.
+    """
+    return "  " * depth + f"- {node.get('name') or ''}: {(node.get('description') or '')[:80]}"
+
+
+def _children(node: dict) -> List[dict]:
+    """
+    The children of a client-sent node, without null entries.
+    """
+    return [child for child in node.get('children') or [] if child]
+
+
+def tree_to_outline(node: dict, max_depth: Optional[int] = None) -> List[str]:
+    """
+    Flatten a knowledge tree into an indented outline, one line per node.
+    Only names and (shortened) descriptions are kept; the computed fields such as
+    totalLearningTime and isAtomic are noise for the model and cost input tokens.
+    Walks the tree iteratively (pre-order) so deep trees can't hit the recursion limit.
+
+    Args:
+        node: The root of the knowledge tree
+        max_depth: Deepest level to include, or None for the whole tree
+
+    Returns:
+        List of outline lines
+    """
+    out = []
+    stack = [(node, 0)]
+    while stack:
+        current, depth = stack.pop()
+        out.append(_outline_line(current, depth))
+        if max_depth is None or depth < max_depth:
+            # Pushed in reverse so children come out in their original order
+            stack.extend((child, depth + 1) for child in reversed(_children(current)))
+    return out
+
+
+def bounded_tree_outline(tree: dict, max_tokens: int) -> List[str]:
+    """
+    Outline a whole knowledge tree, dropping its deepest levels until it fits in max_tokens.
+    The root line is always kept.
+    """
+    lines = tree_to_outline(tree)
+    deepest = max(len(line) - len(line.lstrip(" ")) for line in lines) // 2
+    while deepest > 0 and estimate_tokens("\n".join(lines)) > max_tokens:
+        deepest -= 1
+        lines = tree_to_outline(tree, max_depth=deepest)
+    return lines
+
+
+def concept_path_outline(tree: dict, concept_name: str) -> Optional[List[str]]:
+    """
+    Outline only the part of a knowledge tree that matters for one concept: the path
+    from the root down to it (with descriptions) and the names of its direct children.
+
+    Args:
+        tree: The root of the knowledge tree
+        concept_name: Name of the concept to focus on
+
+    Returns:
+        List of outline lines, or None if the concept isn't in the tree
+    """
+    # Each stack entry links back to its parent's, so the path isn't copied for every node
+    stack = [(tree, None)]
+    while stack:
+        entry = stack.pop()
+        node = entry[0]
+        if node.get('name') == concept_name:
+            path = []
+            while entry is not None:
+                path.append(entry[0])
+                entry = entry[1]
+            path.reverse()
+            lines = [_outline_line(n, depth) for depth, n in enumerate(path)]
+            indent = "  " * len(path)
+            lines.extend(f"{indent}- {child.get('name') or ''}" for child in _children(node))
+            return lines
+        stack.extend((child, entry) for child in reversed(_children(node)))
+    return None
+
+
+# Token budgets for the chat prompt context. The per-turn part (history plus question)
+# shares MAX_TURN_TOKENS, so with the clipped explanation and the path outline a whole
+# chat prompt stays around 4K input tokens.
+MAX_TURN_TOKENS = 2000
+MAX_HISTORY_TOKENS = MAX_TURN_TOKENS
+MAX_HISTORY_MESSAGES = 20  # 10 student/tutor turns
+MAX_QUESTION_TOKENS = 1000
+MAX_EXPLANATION_TOKENS = 1500
+# Budget for the whole-tree outline used when a concept isn't found in its tree
+MAX_OUTLINE_TOKENS = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Roughly estimate the number of tokens in a piece of text.
+    Gemini averages about 4 characters per token for English text.
+    """
+    return len(text) // 4 + 1
+
+
+def trim_chat_history(
+    chat_history: list,
+    max_tokens: int = MAX_HISTORY_TOKENS,
+    max_messages: int = MAX_HISTORY_MESSAGES
+) -> list:
+    """
+    Keep the most recent chat messages that fit within a token budget and a message window.
+
+    Args:
+        chat_history: Chat messages [{"role": "user"/"assistant", "content": "..."}], oldest first
+        max_tokens: Token budget for the kept messages
+        max_messages: Maximum number of messages to keep
+
+    Returns:
+        The newest messages that fit, oldest first
+    """
+    budget = max_tokens
+    kept = []
+    for msg in reversed(chat_history[-max_messages:]):
+        tokens = estimate_tokens(msg['content'])
+        if tokens > budget:
+            break
+        budget -= tokens
+        kept.append(msg)
+    kept.reverse()
+    return kept
+
+
+def clip_text(text: str, max_tokens: int) -> str:
+    """
+    Clip text to roughly max_tokens tokens, marking where it was cut.
+    """
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "\n\n[...]"
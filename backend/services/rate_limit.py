@@ -0,0 +1,36 @@
+import os
+from typing import Dict, Tuple
+from aiolimiter import AsyncLimiter
+
+# Per-model limits of the API project, per worker process: with several workers,
+# set these to the account limits divided by the number of workers
+DEFAULT_RPM = int(os.getenv("LLM_RPM_LIMIT", "500"))
+DEFAULT_TPM = int(os.getenv("LLM_TPM_LIMIT", "1000000"))
+
+
+class ModelRateLimiter:
+    """
+    Client-side token buckets for requests per minute and input tokens per minute.
+
+    Gemini enforces its limits per model, so each model gets its own pair of buckets.
+    Waiting here for a free slot is cheaper than sending a request that comes back
+    as a 429 and then has to be retried.
+    """
+
+    def __init__(self, rpm: int = DEFAULT_RPM, tpm: int = DEFAULT_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._limiters: Dict[str, Tuple[AsyncLimiter, AsyncLimiter]] = {}
+
+    async def acquire(self, model: str, tokens: int):
+        """
+        Wait until one more request with about `tokens` input tokens fits the model's limits.
+        """
+        limiters = self._limiters.get(model)
+        if limiters is None:
+            limiters = (AsyncLimiter(self.rpm, 60), AsyncLimiter(self.tpm, 60))
+            self._limiters[model] = limiters
+        requests, tokens_per_minute = limiters
+        await requests.acquire()
+        # A single request larger than the whole bucket can't wait its way in
+        await tokens_per_minute.acquire(min(tokens, self.tpm))
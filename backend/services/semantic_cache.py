@@ -0,0 +1,87 @@
+from typing import List, Optional, Tuple
+import numpy as np
+
+
+class SemanticIndex:
+    """
+    Nearest-neighbour lookup from concept embeddings to the concepts they were made from,
+    so a near-duplicate request ("Linear Regression" vs "linear regression model") can reuse
+    an already generated result instead of paying for a new LLM call.
+
+    Vectors are kept L2-normalized in one preallocated matrix, so a lookup is a single
+    matrix-vector product. When full, the oldest entries are overwritten.
+    """
+
+    def __init__(self, dimensions: int, threshold: float = 0.92, max_items: int = 512):
+        self.threshold = threshold
+        self.max_items = max_items
+        self.vectors = np.zeros((max_items, dimensions), dtype=np.float32)
+        self.concepts: List[Optional[str]] = [None] * max_items
+        self._next = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, concept: str, vector: List[float]):
+        """
+        Remember the embedding of a concept whose result has been cached.
+        """
+        row = self._normalize(vector)
+        if row is None:
+            return
+        self.vectors[self._next] = row
+        self.concepts[self._next] = concept
+        self._next = (self._next + 1) % self.max_items
+        self._size = min(self._size + 1, self.max_items)
+
+    def lookup(self, vector: List[float]) -> Optional[Tuple[str, float]]:
+        """
+        Find the most similar known concept.
+
+        Returns:
+            (concept, similarity) if the best match is above the threshold, otherwise None
+        """
+        if not self._size:
+            return None
+        query = self._normalize(vector)
+        if query is None:
+            return None
+        scores = self.vectors[:self._size] @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self.concepts[best], float(scores[best])
+
+    def to_state(self) -> dict:
+        """Return a picklable snapshot for persisting the index."""
+        return {
+            "vectors": self.vectors[:self._size].copy(),
+            "concepts": self.concepts[:self._size],
+        }
+
+    def load_state(self, state: dict):
+        """Refill the index from a snapshot made by to_state()."""
+        vectors = state["vectors"]
+        if vectors.ndim != 2 or vectors.shape[1] != self.vectors.shape[1]:
+            return  # Saved with a different embedding size
+        for concept, row in zip(state["concepts"][-self.max_items:], vectors[-self.max_items:]):
+            self.add(concept, row)
+
+    def merge_state(self, state: dict):
+        """Add the entries of a snapshot whose concepts this index doesn't know yet."""
+        known = set(self.concepts[:self._size])
+        vectors = state["vectors"]
+        if vectors.ndim != 2 or vectors.shape[1] != self.vectors.shape[1]:
+            return
+        for concept, row in zip(state["concepts"], vectors):
+            if concept not in known:
+                self.add(concept, row)
+                known.add(concept)
+
+    def _normalize(self, vector) -> Optional[np.ndarray]:
+        row = np.asarray(vector, dtype=np.float32)
+        if row.shape != (self.vectors.shape[1],):
+            return None
+        norm = np.linalg.norm(row)
+        return row / norm if norm else None
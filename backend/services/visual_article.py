@@ -1,16 +1,101 @@
 import os
-import json
 import re
+import asyncio
+import logging
 import argparse
-from typing import List, Dict, Optional
+import contextlib
+import pathlib
+import httpx
+import diskcache
+from typing import List, Dict, Optional, AsyncIterator
 from dotenv import load_dotenv
 from google import genai
+from google.genai import types as genai_types
 from wiki import WikiImageRetrieval
+from image_refs import ImageReferenceFilter
+from semantic_cache import SemanticIndex
+from cache import CACHE_ROOT
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # MODEL = 'models/gemini-2.0-flash-exp'
 MODEL = 'models/gemma-3-27b-it'
+# Short lookups like the page title need a fast model, not the article model
+ROUTING_MODEL = 'models/gemini-2.0-flash-lite'
+
+# Wikipedia fetches share one HTTP/2 connection per run
+HTTP_TIMEOUT = httpx.Timeout(connect=3.0, read=10.0, write=5.0, pool=5.0)
+
+# Quotes and backticks the LLM sometimes wraps a page title in
+_STRIP_CHARS = str.maketrans('', '', '`"\'')
+# Characters dropped from a term to make the default output filename
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w\s-]')
+# Write buffer for streamed articles: a whole article fits, so it reaches disk in one write
+OUTPUT_BUFFER_SIZE = 65536
+
+# Finished articles are reused for the same or a near-identical term
+ARTICLE_CACHE_DIR = os.getenv("ARTICLE_CACHE_DIR", os.path.join(CACHE_ROOT, "articles"))
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+EMBEDDING_DIMENSIONS = 256
+EMBEDDING_TIMEOUT = 2.0
+# Related but distinct terms ("Linear regression" and "Logistic regression") already
+# score around 0.9, so only near-identical phrasings reuse another term's article
+ARTICLE_SIMILARITY_THRESHOLD = 0.97
+
+
+class ArticleCache:
+    """
+    Finished articles on disk, found by normalized term first and otherwise by
+    embedding similarity of the term ("Pythagorean theorem" vs "pythagoras' theorem").
+    The similarity index is stored in the same cache directory.
+    """
+    
+    INDEX_KEY = f"article_index:{EMBEDDING_DIMENSIONS}"
+    
+    def __init__(self, directory: str = ARTICLE_CACHE_DIR):
+        self.disk = diskcache.Cache(directory)
+        self.index = SemanticIndex(EMBEDDING_DIMENSIONS, threshold=ARTICLE_SIMILARITY_THRESHOLD)
+        state = self._read(self.INDEX_KEY)
+        if state:
+            self.index.load_state(state)
+    
+    def key(self, term: str, max_images: int) -> str:
+        return f"{max_images}:{' '.join(term.casefold().split())}"
+    
+    def get(self, key: str) -> Optional[str]:
+        return self._read(key)
+    
+    def lookup(self, embedding: List[float], max_images: int, term: str) -> Optional[str]:
+        """
+        Return the cached article of the most similar term, if it is similar enough,
+        with its title changed to term.
+        """
+        match = self.index.lookup(embedding)
+        if not match or not match[0].startswith(f"{max_images}:"):
+            return None
+        article = self.get(match[0])
+        if article is None:
+            return None
+        print(f"Reusing the article for {match[0].split(':', 1)[1]!r} (similarity {match[1]:.3f})")
+        return _retitle(article, term)
+    
+    def add(self, key: str, article: str, embedding: Optional[List[float]] = None):
+        try:
+            self.disk.set(key, article)
+            if embedding is not None:
+                self.index.add(key, embedding)
+                self.disk.set(self.INDEX_KEY, self.index.to_state())
+        except Exception as e:
+            logger.warning("Error writing article cache: %s", e)
+    
+    def _read(self, key: str):
+        try:
+            return self.disk.get(key)
+        except Exception as e:
+            logger.warning("Error reading article cache: %s", e)
+            return None
 
 
 class VisualArticleGenerator:
@@ -18,16 +103,27 @@ class VisualArticleGenerator:
     Generate illustrated educational articles by:
     1. Finding relevant Wikipedia page for a term
     2. Extracting images from the page
-    3. Analyzing images based on captions and context (text-based)
-    4. Generating article with strategically placed images
+    3. Selecting the most relevant images based on captions and context (text-based)
+       and generating an article with them strategically placed, in one LLM call
+    
+    Steps are coroutines on the async Gemini client.
     """
     
-    def __init__(self, model: str = MODEL):
+    def __init__(self, model: str = MODEL, article_cache: Optional[ArticleCache] = None,
+                 routing_model: str = ROUTING_MODEL):
+        """
+        Args:
+            model: Model that writes the article
+            article_cache: Cache of finished articles (default: one in ARTICLE_CACHE_DIR)
+            routing_model: Fast model for short lookups (the Wikipedia page title)
+        """
         self.model = model
+        self.routing_model = routing_model
         self.client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
         self.wiki_tool = WikiImageRetrieval()
+        self.article_cache = article_cache if article_cache is not None else ArticleCache()
     
-    def find_wikipedia_page(self, term: str) -> Optional[str]:
+    async def find_wikipedia_page(self, term: str) -> Optional[str]:
         """
         Use LLM to find the most relevant Wikipedia page URL for a term.
         Returns the Wikipedia page title (not full URL).
@@ -46,50 +142,46 @@ Term: {term}
 Wikipedia page title:"""
         
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
+            response = await self.client.aio.models.generate_content(
+                model=self.routing_model,
                 contents=prompt
             )
-            page_title = response.text.strip()
             # Clean up any markdown or extra formatting
-            page_title = page_title.replace('`', '').replace('"', '').replace("'", '').strip()
+            page_title = response.text.translate(_STRIP_CHARS).strip()
             # Remove any URL prefix if present
-            if 'wiki/' in page_title:
-                page_title = page_title.split('wiki/')[-1]
+            page_title = page_title.rpartition('wiki/')[2]
             
             print(f"Found Wikipedia page: {page_title}")
             return page_title
         except Exception as e:
-            print(f"Error finding Wikipedia page: {e}")
+            logger.warning("Error finding Wikipedia page: %s", e)
             # Fallback: try to create a title from the term
             return term.replace(' ', '_')
     
-    def select_best_images(self, images: List[Dict], term: str, max_images: int = 5) -> List[Dict]:
+    async def generate_illustrated_article(self, term: str, images: List[Dict], max_images: int = 5) -> str:
         """
-        Analyze ALL images in a single LLM call and select the most relevant ones.
-        Much faster than analyzing each image individually.
+        Choose the most relevant images and write an educational article around them,
+        in a single LLM call: the model selects images by referencing them as [IMG:X].
+        Errors from the LLM call propagate to the caller.
         """
-        print(f"\nAnalyzing all {len(images)} images in a single batch call...")
-        
-        # Prepare image data for batch analysis
-        images_data = []
-        for i, img in enumerate(images):
-            images_data.append({
-                'index': i,
-                'caption': img['caption'][:200] if img['caption'] else 'No caption',
-                'section_text': img.get('section_text', '')[:200] if img.get('section_text') else 'No context'
-            })
+        return ''.join([chunk async for chunk in self.stream_illustrated_article(term, images, max_images)])
+    
+    async def stream_illustrated_article(self, term: str, images: List[Dict], max_images: int = 5) -> AsyncIterator[str]:
+        """
+        Streaming version of generate_illustrated_article: yields the article as the LLM
+        writes it, with image references already converted, line by line.
         
-        prompt = f"""You are selecting the MOST RELEVANT images for an educational article about "{term}".
-
-Here are ALL available images with their captions and context:
+        Args:
+            term: The concept the article is about
+            images: All candidate images of the Wikipedia page
+            max_images: Maximum number of images to use
+        """
+        prompt = f"""You are an expert educator writing an illustrated article about "{term}".
 
-{json.dumps(images_data, indent=2)}
+Here are ALL images available from the Wikipedia article, one per line as id|caption|text of the section it appears in:
+{_image_lines(images)}
 
-Your task:
-1. Analyze ALL images based on their captions and context
-2. Select the TOP {max_images} images that would best help explain "{term}"
-3. Choose images that directly illustrate the concept, show important examples, proofs, or applications
+Use at most {max_images} of these images: the ones that would best help explain "{term}".
 
 Selection criteria (in order of importance):
 - Directly illustrates the main concept "{term}"
@@ -103,84 +195,6 @@ Avoid images that:
 - Show tangential or advanced applications
 - Are about minor edge cases
 
-Respond in JSON format with the selected image indices and brief reasoning:
-{{
-  "selected_images": [
-    {{
-      "index": 0,
-      "relevance_score": 9.5,
-      "reason": "Shows the fundamental theorem proof"
-    }},
-    ...
-  ]
-}}
-
-Return ONLY the top {max_images} most relevant images. Return ONLY valid JSON, no extra text."""
-        
-        try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt
-            )
-            
-            # Parse JSON response
-            response_text = response.text.strip()
-            # Remove markdown code blocks if present
-            response_text = re.sub(r'^```(?:json)?\n', '', response_text)
-            response_text = re.sub(r'\n```$', '', response_text)
-            
-            result = json.loads(response_text)
-            
-            # Extract selected images
-            selected_images = []
-            for selection in result.get('selected_images', []):
-                idx = selection['index']
-                if 0 <= idx < len(images):
-                    img = images[idx].copy()
-                    img['analysis'] = {
-                        'relevant': True,
-                        'description': selection.get('reason', img['caption']),
-                        'relevance_score': selection.get('relevance_score', 8.0)
-                    }
-                    selected_images.append(img)
-            
-            print(f"\n✓ Selected {len(selected_images)} most relevant images")
-            return selected_images
-            
-        except Exception as e:
-            print(f"Error in batch image selection: {e}")
-            print("Falling back to simple selection based on caption length...")
-            # Fallback: select images with substantial captions
-            fallback = []
-            for img in images:
-                if img['caption'] and len(img['caption']) > 20:
-                    img['analysis'] = {
-                        'relevant': True,
-                        'description': img['caption'],
-                        'relevance_score': 5.0
-                    }
-                    fallback.append(img)
-            return fallback[:max_images]
-    
-    def generate_illustrated_article(self, term: str, images: List[Dict], section_texts: Dict[str, str]) -> str:
-        """
-        Generate an educational article with strategically placed images.
-        """
-        # Prepare image information for the LLM
-        image_info = []
-        for i, img in enumerate(images):
-            image_info.append({
-                'id': i,
-                'caption': img['caption'],
-                'description': img['analysis']['description'],
-                'section_text': img['section_text'][:200] + '...' if len(img['section_text']) > 200 else img['section_text']
-            })
-        
-        prompt = f"""You are an expert educator writing an illustrated article about "{term}".
-
-You have access to these images:
-{json.dumps(image_info, indent=2)}
-
 **ABSOLUTELY CRITICAL - IMAGE REFERENCE FORMAT:**
 
 CORRECT way to show images:
@@ -193,13 +207,12 @@ WRONG - DO NOT DO THIS:
 ✗ ![Image](IMAGE_0)
 ✗ Any URL or markdown syntax
 
-YOU MUST ONLY USE: [IMG:0], [IMG:1], [IMG:2]
+YOU MUST ONLY USE: [IMG:X] where X is the id of an image from the list above
 Do not write ANY URLs. Do not write ANY markdown image syntax.
-ONLY write [IMG:X] where X is the image number.
 
 Please write a comprehensive, educational article about "{term}" that:
 1. Explains the concept clearly and thoroughly
-2. Uses the provided images strategically throughout the article
+2. Uses the selected images strategically throughout the article
 3. Places each image where it's most relevant to the content
 4. Provides context for each image
 
@@ -207,7 +220,7 @@ Format your response as Markdown with the following structure:
 - Use # for the main title
 - Use ## for major sections
 - Use ### for subsections
-- Place images using: [IMG:0], [IMG:1], [IMG:2], etc.
+- Place images using: [IMG:X], using each selected image once
 - Add a brief sentence before or after each image explaining what it shows
 
 Example format:
@@ -216,7 +229,7 @@ Example format:
 ## Introduction
 [Introduction text...]
 
-[IMG:0]
+[IMG:3]
 *This diagram illustrates...*
 
 ## Main Section
@@ -224,59 +237,157 @@ Example format:
 
 Write a well-structured, informative article (aim for 500-800 words) with images placed strategically throughout."""
         
+        stream = await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=prompt
+        )
+        
+        # Convert [IMG:X] references to markdown images with the correct URLs, drop lines with
+        # Wikipedia URLs (the LLM sometimes ignores instructions) and collapse blank-line runs,
+        # each line as soon as it is complete. The model may pick more images than asked
+        # for; only the first max_images it references are shown.
+        image_filter = ImageReferenceFilter(images, max_images=max_images)
+        async for chunk in stream:
+            if chunk.text:
+                text = image_filter.feed(chunk.text)
+                if text:
+                    yield text
+        text = image_filter.flush().rstrip()
+        if text:
+            yield text
+    
+    async def _embed_term(self, term: str) -> Optional[List[float]]:
+        """
+        Embed a term for the article cache; None if the call fails or is slow.
+        """
         try:
-            response = self.client.models.generate_content(
-                model=self.model,
-                contents=prompt
-            )
-            
-            article = response.text.strip()
-            
-            # Convert [IMG:X] references to markdown image syntax with correct URLs
-            # Remove any lines containing Wikipedia URLs (LLM sometimes ignores instructions)
-            lines = article.split('\n')
-            cleaned_lines = []
-            for line in lines:
-                if 'upload.wikimedia.org' not in line.lower():
-                    cleaned_lines.append(line)
-            article = '\n'.join(cleaned_lines)
-            
-            # Convert [IMG:X] references to proper markdown
-            for i, img in enumerate(images):
-                reference = f'[IMG:{i}]'
-                caption = img['caption'][:100] if img['caption'] else f"Image {i}"
-                url = img['url']
-                markdown_image = f"\n\n![{caption}]({url})\n\n"
-                article = article.replace(reference, markdown_image)
-            
-            # Clean up extra whitespace
-            article = re.sub(r'\n{3,}', '\n\n', article)
-            
-            return article
+            async with asyncio.timeout(EMBEDDING_TIMEOUT):
+                response = await self.client.aio.models.embed_content(
+                    model=EMBEDDING_MODEL,
+                    contents=term,
+                    config=genai_types.EmbedContentConfig(
+                        task_type="SEMANTIC_SIMILARITY",
+                        output_dimensionality=EMBEDDING_DIMENSIONS
+                    )
+                )
+            return response.embeddings[0].values
         except Exception as e:
-            print(f"Error generating article: {e}")
-            return f"# {term}\n\nError generating article: {str(e)}"
+            logger.warning("Could not embed term: %s", e)
+            return None
+    
+    async def _fetch_images(self, page_title: str) -> List[Dict]:
+        """
+        Extract the images of a Wikipedia page; a failed fetch counts as no images.
+        """
+        try:
+            results = await self.wiki_tool.extract_images_detailed_async(page_title)
+        except httpx.HTTPError as e:
+            logger.warning("Error fetching Wikipedia page: %s", e)
+            return []
+        return results['images']
     
     def generate_visual_article(self, term: str, output_file: Optional[str] = None, max_images: int = 5) -> str:
         """
         Complete pipeline: Find Wikipedia page, extract images, generate illustrated article.
+        Blocking wrapper around generate_visual_article_async for scripts and the CLI.
+        """
+        return asyncio.run(self.generate_visual_article_async(term, output_file, max_images))
+    
+    async def generate_visual_article_async(self, term: str, output_file: Optional[str] = None, max_images: int = 5) -> str:
+        """
+        Async version of generate_visual_article.
+        """
+        async with self._wiki_client():
+            return await self._generate_visual_article(term, output_file, max_images)
+    
+    async def generate_visual_articles_batch(self, terms: List[str], concurrency: int = 8, max_images: int = 5) -> List[str]:
+        """
+        Generate articles for several terms concurrently, each saved to its default file.
+        
+        Args:
+            terms: The terms to write articles about
+            concurrency: Maximum number of articles generated at the same time
+            max_images: Maximum number of images per article
+            
+        Returns:
+            The articles, in the order of terms; a term that failed gets an error article
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def generate(term: str) -> str:
+            async with semaphore:
+                # Interleaved streams would be unreadable, so articles are only saved
+                return await self._generate_visual_article(term, None, max_images, echo=False)
+        
+        # Every term finishes before the shared client is closed, and one failure
+        # doesn't discard the articles of the others
+        async with self._wiki_client():
+            results = await asyncio.gather(*(generate(term) for term in terms), return_exceptions=True)
+        
+        articles = []
+        for term, result in zip(terms, results):
+            if isinstance(result, BaseException):
+                logger.warning("Error generating article for %s: %s", term, result)
+                result = f"# {term}\n\nError generating article: {str(result)}"
+            articles.append(result)
+        return articles
+    
+    @contextlib.asynccontextmanager
+    async def _wiki_client(self):
+        """
+        Give the Wikipedia tool an HTTP/2 client for the duration of a run.
+        """
+        async with httpx.AsyncClient(http2=True, timeout=HTTP_TIMEOUT) as http_client:
+            self.wiki_tool.http_client = http_client
+            try:
+                yield
+            finally:
+                self.wiki_tool.http_client = None
+    
+    async def _generate_visual_article(self, term: str, output_file: Optional[str], max_images: int,
+                                       echo: bool = True) -> str:
+        """
+        The pipeline; echo prints the article to the terminal as it streams in.
         """
         print(f"=== Generating Visual Article for: {term} ===\n")
         
-        # Step 1: Find Wikipedia page
+        # Reuse a finished article for the same term, or failing that a near-identical one
+        cache_key = self.article_cache.key(term, max_images)
+        article = self.article_cache.get(cache_key)
+        embedding = None
+        if article is None:
+            embedding = await self._embed_term(term)
+            if embedding is not None:
+                article = self.article_cache.lookup(embedding, max_images, term)
+        if article is not None:
+            print("Found a cached article")
+            return self._save_article(term, article, output_file)
+        
+        # Steps 1 and 2: Find the Wikipedia page and extract its images. The LLM picks the
+        # page (so ambiguous terms don't land on a disambiguation or unrelated article);
+        # its answer is usually just the term with underscores, so that page is prefetched
+        # while the LLM answers and used only if the titles match.
         print("Step 1: Finding Wikipedia page...")
-        wiki_page = self.find_wikipedia_page(term)
+        guessed_page = term.replace(' ', '_')
+        prefetch = asyncio.create_task(self._fetch_images(guessed_page))
+        try:
+            wiki_page = await self.find_wikipedia_page(term)
+        except BaseException:
+            prefetch.cancel()
+            raise
         if not wiki_page:
+            prefetch.cancel()
             return f"Could not find Wikipedia page for {term}"
         
+        if _same_page(wiki_page, guessed_page):
+            images = await prefetch
+        else:
+            prefetch.cancel()
+            images = await self._fetch_images(wiki_page)
+        
         wiki_url = f"https://en.wikipedia.org/wiki/{wiki_page}"
         print(f"Found: {wiki_url}\n")
-        
-        # Step 2: Extract images
-        print("Step 2: Extracting images from Wikipedia...")
-        results = self.wiki_tool.extract_images_detailed(wiki_page)
-        images = results['images']
-        print(f"Extracted {len(images)} images\n")
+        print(f"Step 2: Extracted {len(images)} images\n")
         
         if not images:
             print("No images found. Generating article without images...")
@@ -284,39 +395,90 @@ Write a well-structured, informative article (aim for 500-800 words) with images
             article += f"Source: [{wiki_url}]({wiki_url})"
             return article
         
-        # Step 3: Select best images
-        print("Step 3: Analyzing and selecting best images...")
-        selected_images = self.select_best_images(images, term, max_images)
-        
-        if not selected_images:
-            print("No relevant images found. Generating article without images...")
-            article = f"# {term}\n\n*No relevant images found.*\n\n"
-            article += f"Source: [{wiki_url}]({wiki_url})"
-            return article
-        
-        # Step 4: Generate article
-        print("\nStep 4: Generating illustrated article...")
-        section_texts = {img['filename']: img['section_text'] for img in selected_images}
-        article = self.generate_illustrated_article(term, selected_images, section_texts)
-        
-        # Add source attribution
-        article += f"\n\n---\n*Source: Wikipedia - [{wiki_url}]({wiki_url})*\n"
-        
-        # Step 5: Save to file
-        if not output_file:
-            # Generate filename from term
-            safe_term = re.sub(r'[^\w\s-]', '', term).strip().replace(' ', '_')
-            output_file = f"{safe_term}_article.md"
+        # Steps 3 and 4: Select the best images and write the article around them, in one
+        # call, streaming it to the terminal and the output file as it is generated
+        print("Step 3: Selecting images and generating illustrated article...\n")
+        output_file = self._output_path(term, output_file)
+        parts = []
+        # The terminal shows the stream live, so the file can take it in large buffered writes
+        with open(output_file, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER_SIZE) as f:
+            try:
+                async for text in self.stream_illustrated_article(term, images, max_images):
+                    parts.append(text)
+                    f.write(text)
+                    if echo:
+                        print(text, end='', flush=True)
+            except Exception as e:
+                print(f"\nError generating article: {e}")
+                error_article = f"# {term}\n\nError generating article: {str(e)}"
+                f.seek(0)
+                f.truncate()
+                f.write(error_article)
+                return error_article
+            
+            # Add source attribution
+            attribution = f"\n\n---\n*Source: Wikipedia - [{wiki_url}]({wiki_url})*\n"
+            f.write(attribution)
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write(article)
+        article = ''.join(parts) + attribution
+        self.article_cache.add(cache_key, article, embedding)
+        print(f"\n\n✓ Article saved to: {output_file}")
+        print("✓ Open it in a browser or markdown viewer to see the images!")
+        return article
+    
+    def _output_path(self, term: str, output_file: Optional[str]) -> str:
+        if output_file:
+            return output_file
+        # Generate filename from term
+        safe_term = _UNSAFE_FILENAME_RE.sub('', term).strip().replace(' ', '_')
+        return f"{safe_term}_article.md"
+    
+    def _save_article(self, term: str, article: str, output_file: Optional[str]) -> str:
+        """
+        Save an already finished article to a markdown file and return it.
+        """
+        output_file = self._output_path(term, output_file)
+        pathlib.Path(output_file).write_text(article, encoding='utf-8')
         
         print(f"\n✓ Article saved to: {output_file}")
-        print(f"✓ Open it in a browser or markdown viewer to see the images!")
+        print("✓ Open it in a browser or markdown viewer to see the images!")
         
         return article
 
 
+def _image_lines(images: List[Dict]) -> str:
+    """
+    List the candidate images for the article prompt as id|caption|context lines, which
+    takes far fewer tokens than JSON objects repeating the key names for every image.
+    """
+    return '\n'.join(
+        f"{i}|{_one_field(img['caption'][:200]) or 'No caption'}|{_one_field(img['section_text'][:200]) or 'No context'}"
+        for i, img in enumerate(images)
+    )
+
+
+def _one_field(text: str) -> str:
+    # Keep a value on one line and free of the field separator
+    return ' '.join(text.replace('|', ' ').split())
+
+
+def _retitle(article: str, term: str) -> str:
+    """
+    Replace the article's leading "# <title>" line with the given term.
+    """
+    first_line, newline, rest = article.partition('\n')
+    if not first_line.startswith('# '):
+        return article
+    return f"# {term}{newline}{rest}"
+
+
+def _same_page(title: str, other: str) -> bool:
+    """
+    Whether two page titles name the same Wikipedia page (the first letter is case-insensitive).
+    """
+    return title[:1].upper() + title[1:] == other[:1].upper() + other[1:]
+
+
 def main():
     """
     CLI interface for generating visual articles.
@@ -325,14 +487,23 @@ def main():
         description='Generate illustrated educational articles from Wikipedia.'
     )
     parser.add_argument(
-        'term',
+        'terms',
         type=str,
-        help='The term or concept to create an article about (e.g., "Pythagorean theorem")'
+        nargs='+',
+        metavar='term',
+        help='The term or concept to create an article about (e.g., "Pythagorean theorem"); '
+             'several terms are generated concurrently'
     )
     parser.add_argument(
         '-o', '--output',
         type=str,
-        help='Output markdown file path (default: auto-generated from term)'
+        help='Output markdown file path (default: auto-generated from term; single term only)'
+    )
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        default=8,
+        help='Maximum number of articles generated at the same time (default: 8)'
     )
     parser.add_argument(
         '-n', '--num-images',
@@ -346,24 +517,34 @@ def main():
         default=MODEL,
         help=f'Model to use (default: {MODEL})'
     )
+    parser.add_argument(
+        '--routing-model',
+        type=str,
+        default=ROUTING_MODEL,
+        help=f'Fast model for the Wikipedia page lookup (default: {ROUTING_MODEL})'
+    )
     
     args = parser.parse_args()
+    if args.output and len(args.terms) > 1:
+        parser.error('--output can only be used with a single term')
     
     # Create generator
-    generator = VisualArticleGenerator(model=args.model)
+    generator = VisualArticleGenerator(model=args.model, routing_model=args.routing_model)
+    
+    if len(args.terms) > 1:
+        asyncio.run(generator.generate_visual_articles_batch(
+            args.terms,
+            concurrency=args.concurrency,
+            max_images=args.num_images
+        ))
+        return
     
-    # Generate article
-    article = generator.generate_visual_article(
-        term=args.term,
+    # Generate article (printed as it streams in)
+    generator.generate_visual_article(
+        term=args.terms[0],
         output_file=args.output,
         max_images=args.num_images
     )
-    
-    # Print preview
-    print("\n" + "=" * 80)
-    print("ARTICLE PREVIEW (first 500 characters):")
-    print("=" * 80)
-    print(article[:500] + "...\n")
 
 
 if __name__ == "__main__":
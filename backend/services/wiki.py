@@ -1,23 +1,170 @@
-import requests
+import os
+import gzip
+import time
+import asyncio
+import logging
+import httpx
+import diskcache
 from bs4 import BeautifulSoup
 from typing import List, Dict, Optional
 from urllib.parse import urljoin, urlparse, unquote
 import re
+try:
+    from services.cache import CACHE_ROOT
+except ImportError:  # Run as a script from services/, like visual_article.py
+    from cache import CACHE_ROOT
+
+logger = logging.getLogger(__name__)
+
+WIKI_CACHE_DIR = os.getenv("WIKI_CACHE_DIR", os.path.join(CACHE_ROOT, "wiki"))
+WIKI_CACHE_TTL = 7 * 86400  # Drop pages nobody asked for in a week
+WIKI_FRESH_SECONDS = 3600  # Serve cached pages this recent without asking Wikipedia
+
+# Headings that start a section, and the elements whose text makes up section text
+SECTION_HEADINGS = frozenset(['h2', 'h3', 'h4', 'h5', 'h6'])
+SECTION_TEXT_TAGS = frozenset(['p', 'li', 'dd', 'dt'])
+
+# lxml's C parser is several times faster than html.parser on full articles. Pages are
+# handed to it as bytes so it decodes them itself (Wikipedia declares UTF-8).
+HTML_PARSER = 'lxml'
+
+# Regexes used per paragraph and per image, compiled once
+_REF_MARKER_RE = re.compile(r'\[\d+\]')  # Reference markers like [1], [2]
+_WHITESPACE_RE = re.compile(r'\s+')
+_WIKI_PATH_RE = re.compile(r'/wiki/([^#?]+)')
+
+
+class PageCache:
+    """
+    On-disk cache of Wikipedia page HTML, gzipped, with the ETag and Last-Modified
+    validators of each response. Recent pages are served straight from disk; older
+    ones are revalidated with a conditional GET, and a 304 reuses the stored body.
+    """
+    
+    def __init__(self, directory: str = WIKI_CACHE_DIR):
+        self.disk = diskcache.Cache(directory)
+    
+    def get(self, page_title: str) -> Optional[Dict]:
+        """
+        Return the cached entry for a page, or None. Never raises.
+        """
+        try:
+            return self.disk.get(page_title)
+        except Exception as e:
+            logger.warning("Error reading Wikipedia page cache: %s", e)
+            return None
+    
+    def is_fresh(self, entry: Dict) -> bool:
+        return time.time() - entry['fetched_at'] < WIKI_FRESH_SECONDS
+    
+    def content(self, entry: Dict) -> bytes:
+        return gzip.decompress(entry['body'])
+    
+    def conditional_headers(self, entry: Optional[Dict]) -> Dict[str, str]:
+        """
+        Headers that turn a GET into a revalidation of the cached copy.
+        """
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def store(self, page_title: str, headers, content: bytes):
+        """
+        Save a freshly downloaded page with its validators.
+        """
+        self._write(page_title, {
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'body': gzip.compress(content),
+            'fetched_at': time.time()
+        })
+    
+    def touch(self, page_title: str, entry: Dict):
+        """
+        Mark a cached page as fresh again after Wikipedia answered 304 Not Modified.
+        """
+        self._write(page_title, {**entry, 'fetched_at': time.time()})
+    
+    def _write(self, page_title: str, entry: Dict):
+        try:
+            self.disk.set(page_title, entry, expire=WIKI_CACHE_TTL)
+        except Exception as e:
+            logger.warning("Error writing Wikipedia page cache: %s", e)
 
 
 class WikiImageRetrieval:
     """
     A tool to retrieve images from Wikipedia pages along with their captions 
     and the innermost section/subsection text they appear in.
+    
+    Call close() (or use it as a context manager) to release the connection opened
+    by the sync methods.
     """
     
     BASE_URL = "https://en.wikipedia.org"
+    HEADERS = {
+        'User-Agent': 'WikiImageRetrieval/1.0 (Educational Project)'
+    }
     
-    def __init__(self):
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'WikiImageRetrieval/1.0 (Educational Project)'
-        })
+    # Common icon/UI image patterns
+    SKIP_SRC_PATTERNS = (
+        'Icon_',
+        'Edit_icon',
+        'Information_icon',
+        'Question_book',
+        'Ambox',
+        'Crystal_',
+        'Magnify-clip',
+        '/static/',
+        'Wikipedia-logo',
+        'Wikimedia-logo',
+    )
+    # Containers (navigation, sidebars, ...) whose images are not content
+    SKIP_CLASSES = frozenset(['navbox', 'navigation', 'sidebar', 'infobox', 'metadata', 'mbox'])
+    
+    def __init__(self, http_client: Optional[httpx.AsyncClient] = None, page_cache: Optional[PageCache] = None):
+        """
+        Args:
+            http_client: Shared async client used by extract_images_detailed_async;
+                the caller owns it and is responsible for closing it
+            page_cache: Cache for downloaded page HTML (default: one in WIKI_CACHE_DIR)
+        """
+        # Sync client, created on the first sync fetch so async-only users never open one
+        self.session: Optional[httpx.Client] = None
+        self.http_client = http_client
+        self.page_cache = page_cache if page_cache is not None else PageCache()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+    
+    def close(self):
+        """
+        Close the sync client, if one was opened. The async client belongs to the caller.
+        """
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+    
+    def _sync_client(self) -> httpx.Client:
+        """
+        The sync client: one HTTP/2 connection to Wikipedia, reused across sync fetches.
+        """
+        if self.session is None:
+            self.session = httpx.Client(
+                http2=True,
+                headers=self.HEADERS,
+                timeout=10.0,
+                limits=httpx.Limits(max_keepalive_connections=20),
+                follow_redirects=True
+            )
+        return self.session
     
     def _normalize_page_input(self, page_input: str) -> str:
         """
@@ -28,7 +175,7 @@ class WikiImageRetrieval:
         if page_input.startswith('http'):
             parsed = urlparse(page_input)
             # Extract page title from URL path like /wiki/Page_Title
-            match = re.search(r'/wiki/([^#?]+)', parsed.path)
+            match = _WIKI_PATH_RE.search(parsed.path)
             if match:
                 return unquote(match.group(1))
             return page_input
@@ -36,73 +183,47 @@ class WikiImageRetrieval:
     
     def _get_page_html(self, page_title: str) -> Optional[BeautifulSoup]:
         """
-        Fetch the HTML content of a Wikipedia page.
+        Fetch the HTML content of a Wikipedia page, using the page cache when possible.
         """
         page_url = f"{self.BASE_URL}/wiki/{page_title}"
+        entry = self.page_cache.get(page_title)
+        if entry and self.page_cache.is_fresh(entry):
+            return BeautifulSoup(self.page_cache.content(entry), HTML_PARSER)
         
         try:
-            response = self.session.get(page_url, timeout=10)
+            response = self._sync_client().get(page_url, headers=self.page_cache.conditional_headers(entry))
+            if response.status_code == 304 and entry:
+                self.page_cache.touch(page_title, entry)
+                return BeautifulSoup(self.page_cache.content(entry), HTML_PARSER)
             response.raise_for_status()
-            return BeautifulSoup(response.text, 'html.parser')
-        except requests.RequestException as e:
-            print(f"Error fetching Wikipedia page: {e}")
+            self.page_cache.store(page_title, response.headers, response.content)
+            return BeautifulSoup(response.content, HTML_PARSER)
+        except httpx.HTTPError as e:
+            logger.warning("Error fetching Wikipedia page: %s", e)
             return None
     
-    def _find_innermost_section(self, element) -> str:
+    async def _get_page_html_async(self, page_title: str) -> Optional[bytes]:
         """
-        Find the innermost section/subsection text that contains this element.
-        Returns the full text content of the section (not just the heading).
+        Fetch the raw HTML of a Wikipedia page with the shared async client, using the
+        page cache when possible (its disk reads and writes run in a worker thread).
+        Returns None if the page doesn't exist; other failures raise httpx.HTTPError,
+        so callers can tell a missing page from a temporary problem.
         """
-        if not element:
-            return ""
-        
-        # Find the nearest heading before this element
-        heading_element = None
-        heading_level = None
-        
-        try:
-            for prev in element.find_all_previous():
-                if hasattr(prev, 'name') and prev.name in ['h2', 'h3', 'h4', 'h5', 'h6']:
-                    heading_element = prev
-                    heading_level = int(prev.name[1])  # Extract number from h2, h3, etc.
-                    break
-        except AttributeError:
-            pass
-        
-        if not heading_element:
-            return ""
-        
-        # Collect all paragraph and list text after the heading until the next heading
-        section_texts = []
-        
-        # Use find_all_next to find all elements after the heading
-        for next_elem in heading_element.find_all_next():
-            # Stop if we hit another heading of same or higher level
-            if next_elem.name in ['h2', 'h3', 'h4', 'h5', 'h6']:
-                next_level = int(next_elem.name[1])
-                if next_level <= heading_level:
-                    break
-            
-            # Only collect text from paragraph and list elements
-            if next_elem.name in ['p', 'li', 'dd', 'dt']:
-                text = next_elem.get_text(strip=True)
-                # Filter out [edit] links, empty strings, and reference markers
-                if text and '[edit]' not in text and text != '':
-                    # Remove reference markers like [1], [2], etc.
-                    text = re.sub(r'\[\d+\]', '', text)
-                    section_texts.append(text)
-            
-            # Stop if we've found the image element itself (don't go past it)
-            if next_elem == element or element in next_elem.descendants:
-                break
-        
-        # Join all collected text
-        full_text = ' '.join(section_texts)
-        
-        # Clean up extra whitespace
-        full_text = re.sub(r'\s+', ' ', full_text).strip()
+        page_url = f"{self.BASE_URL}/wiki/{page_title}"
+        entry = await asyncio.to_thread(self.page_cache.get, page_title)
+        if entry and self.page_cache.is_fresh(entry):
+            return self.page_cache.content(entry)
         
-        return full_text
+        headers = {**self.HEADERS, **self.page_cache.conditional_headers(entry)}
+        response = await self.http_client.get(page_url, headers=headers, timeout=10, follow_redirects=True)
+        if response.status_code == 304 and entry:
+            await asyncio.to_thread(self.page_cache.touch, page_title, entry)
+            return self.page_cache.content(entry)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        await asyncio.to_thread(self.page_cache.store, page_title, response.headers, response.content)
+        return response.content
     
     def _extract_image_caption(self, img_element) -> str:
         """
@@ -134,9 +255,14 @@ class WikiImageRetrieval:
         
         return ""
     
-    def _is_valid_content_image(self, img_element) -> bool:
+    def _is_valid_content_image(self, img_element, ancestor_memo: Optional[Dict[int, bool]] = None) -> bool:
         """
         Filter out UI icons, logos, LaTeX formulas, and other non-content images.
+        
+        Args:
+            img_element: The <img> tag
+            ancestor_memo: Per-page dict shared between calls, so images with common
+                ancestors don't walk the same parent chain again
         """
         src = img_element.get('src', '')
         
@@ -144,44 +270,46 @@ class WikiImageRetrieval:
         if '/media/math/render/svg/' in src:
             return False
         
-        # Skip tiny images (icons, bullets, etc.)
-        width = img_element.get('width')
-        if width and int(width) < 50:
+        # Skip tiny images (icons, bullets, etc.); non-numeric widths like "50px" are ignored
+        width = img_element.attrs.get('width')
+        if width is not None and width.isdigit() and int(width) < 50:
             return False
         
         # Skip common icon/UI image patterns
-        skip_patterns = [
-            'Icon_',
-            'Edit_icon',
-            'Information_icon',
-            'Question_book',
-            'Ambox',
-            'Crystal_',
-            'Magnify-clip',
-            '/static/',
-            'Wikipedia-logo',
-            'Wikimedia-logo',
-        ]
-        
-        for pattern in skip_patterns:
+        for pattern in self.SKIP_SRC_PATTERNS:
             if pattern in src:
                 return False
         
-        # Skip if it's in the navigation or sidebar
-        parent_classes = []
-        current = img_element.parent
-        while current:
-            if hasattr(current, 'get'):
-                classes = current.get('class', [])
-                parent_classes.extend(classes)
-            current = current.parent
-        
-        skip_classes = ['navbox', 'navigation', 'sidebar', 'infobox', 'metadata', 'mbox']
-        if any(skip_class in parent_classes for skip_class in skip_classes):
+        # Skip if it's in the navigation or sidebar (the only check that walks the tree, so last)
+        if self._in_skipped_container(img_element, {} if ancestor_memo is None else ancestor_memo):
             return False
         
         return True
     
+    def _in_skipped_container(self, element, memo: Dict[int, bool]) -> bool:
+        """
+        Whether any ancestor of element has one of SKIP_CLASSES. The answer for every
+        ancestor visited is stored in memo (keyed by id, valid while the soup is alive),
+        so the walk stops at the first ancestor already seen.
+        """
+        chain = []
+        skipped = False
+        current = element.parent
+        while current is not None:
+            known = memo.get(id(current))
+            if known is not None:
+                skipped = known
+                break
+            chain.append(current)
+            if not self.SKIP_CLASSES.isdisjoint(current.get('class') or ()):
+                skipped = True
+                break
+            current = current.parent
+        
+        for ancestor in chain:
+            memo[id(ancestor)] = skipped
+        return skipped
+    
     def extract_images(self, page_input: str) -> List[Dict[str, str]]:
         """
         Extract all images from a Wikipedia page along with their captions 
@@ -197,12 +325,29 @@ class WikiImageRetrieval:
             - section_text: Full text content of the innermost section/subsection where the image appears
             - filename: Image filename
         """
-        page_title = self._normalize_page_input(page_input)
+        return self._images_from_page(self._normalize_page_input(page_input))
+    
+    def _images_from_page(self, page_title: str) -> List[Dict[str, str]]:
+        """
+        Fetch a page by its already normalized title and extract its images, like extract_images.
+        """
         soup = self._get_page_html(page_title)
         
         if not soup:
             return []
         
+        return self._images_from_soup(soup)
+    
+    def _images_from_html(self, html: bytes) -> List[Dict[str, str]]:
+        """
+        Parse page HTML and extract its content images, like extract_images.
+        """
+        return self._images_from_soup(BeautifulSoup(html, HTML_PARSER))
+    
+    def _images_from_soup(self, soup: BeautifulSoup) -> List[Dict[str, str]]:
+        """
+        Extract the content images of a parsed page, see extract_images.
+        """
         # Find the main content area (avoid header, footer, navigation)
         content = soup.find('div', {'id': 'mw-content-text'})
         if not content:
@@ -210,10 +355,38 @@ class WikiImageRetrieval:
         
         images = []
         
-        # Find all img tags in the content
-        for img in content.find_all('img'):
+        # One document-order walk collects both the images and the text of the innermost
+        # section each one appears in: the paragraph and list text from the nearest heading
+        # up to the image's top-level container (its outermost ancestor after the heading),
+        # so text inside that container, like a gallery's other captions, is left out.
+        # Images before the first heading get no section text.
+        section_texts = None  # (position, text) of each text element since the heading
+        heading_lineage = set()
+        positions = {}
+        ancestor_memo = {}
+        for position, element in enumerate(content.descendants):
+            name = element.name
+            if name is None:
+                continue  # Text node
+            positions[id(element)] = position
+            if name in SECTION_HEADINGS:
+                section_texts = []
+                heading_lineage = {id(element), *map(id, element.parents)}
+                continue
+            if name in SECTION_TEXT_TAGS:
+                if section_texts is not None:
+                    text = element.get_text(strip=True)
+                    # Filter out [edit] links, empty strings, and reference markers
+                    if text and '[edit]' not in text:
+                        # Remove reference markers like [1], [2], etc.
+                        section_texts.append((position, _REF_MARKER_RE.sub('', text)))
+                continue
+            if name != 'img':
+                continue
+            img = element
+            
             # Filter out non-content images
-            if not self._is_valid_content_image(img):
+            if not self._is_valid_content_image(img, ancestor_memo):
                 continue
             
             src = img.get('src', '')
@@ -229,8 +402,17 @@ class WikiImageRetrieval:
             # Extract caption
             caption = self._extract_image_caption(img)
             
-            # Find the innermost section text
-            section_text = self._find_innermost_section(img)
+            # Text of the innermost section so far, with extra whitespace cleaned up
+            section_text = ""
+            if section_texts:
+                container = img
+                for parent in img.parents:
+                    if id(parent) in heading_lineage:
+                        break
+                    container = parent
+                end = positions[id(container)]
+                texts = [text for position, text in section_texts if position <= end]
+                section_text = _WHITESPACE_RE.sub(' ', ' '.join(texts)).strip()
             
             # Extract filename from URL
             filename = src.split('/')[-1]
@@ -258,8 +440,22 @@ class WikiImageRetrieval:
             - images: List of image data dictionaries
         """
         page_title = self._normalize_page_input(page_input)
-        images = self.extract_images(page_input)
-        
+        images = self._images_from_page(page_title)
+        return self._detailed_result(page_title, images)
+    
+    async def extract_images_detailed_async(self, page_input: str) -> Dict:
+        """
+        Async version of extract_images_detailed for use on an event loop.
+        The page is fetched with the shared async client; parsing a large article
+        takes tens of milliseconds, so it runs in a worker thread.
+        Unlike the sync version, fetch errors other than a missing page raise httpx.HTTPError.
+        """
+        page_title = self._normalize_page_input(page_input)
+        html = await self._get_page_html_async(page_title)
+        images = await asyncio.to_thread(self._images_from_html, html) if html else []
+        return self._detailed_result(page_title, images)
+    
+    def _detailed_result(self, page_title: str, images: List[Dict[str, str]]) -> Dict:
         return {
             'page_title': page_title,
             'page_url': f"{self.BASE_URL}/wiki/{page_title}",
@@ -272,7 +468,7 @@ def main():
     """
     Example usage of the WikiImageRetrieval tool.
     """
-    import json
+    import orjson
     import argparse
     
     # Set up argument parser
@@ -293,9 +489,6 @@ def main():
     
     args = parser.parse_args()
     
-    # Create an instance
-    wiki_tool = WikiImageRetrieval()
-    
     # Use provided URL or default example
     if args.url:
         page = args.url
@@ -307,8 +500,9 @@ def main():
     print(f"Extracting images from Wikipedia page: {page}\n")
     print("=" * 80)
     
-    # Get detailed results
-    results = wiki_tool.extract_images_detailed(page)
+    # Get detailed results; closing the tool releases its connection
+    with WikiImageRetrieval() as wiki_tool:
+        results = wiki_tool.extract_images_detailed(page)
     
     print(f"Page: {results['page_title']}")
     print(f"URL: {results['page_url']}")
@@ -323,8 +517,8 @@ def main():
         print(f"URL: {img['url']}")
     
     # Save to JSON file
-    with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+    with open(args.output, 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
     
     print(f"\n\nResults saved to {args.output}")
 
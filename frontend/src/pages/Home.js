@@ -1,14 +1,45 @@
-import React, { useState, useCallback } from 'react';
+import React, { useState, useCallback, useRef, useEffect, useMemo } from 'react';
 import { Link } from 'react-router-dom';
 import MarkdownWithLatex from '../components/MarkdownWithLatex';
 import { useTooltip } from '../hooks/useTooltip';
 import { useD3Tree } from '../hooks/useD3Tree';
 import { useKeyboardNavigation } from '../hooks/useKeyboardNavigation';
 import API_URL from '../config';
+import { readEventStream } from '../utils/streamUtils';
+
+// The backend only uses the most recent chat turns, so don't upload the rest
+const MAX_CHAT_HISTORY = 20;
+
+// Ask for explanations of the root and its children along with the map, so the
+// most likely first clicks render without another request (0 turns this off)
+const SEED_EXPLANATION_DEPTH = 1;
+
+// The tree sent back as context for explanations and chat, without any seeded
+// explanations: the backend only needs names and descriptions
+const treeForRequest = (node) => {
+  const { explanation, children, ...rest } = node;
+  return { ...rest, children: (children || []).filter(Boolean).map(treeForRequest) };
+};
+
+// Abort the stream a ref is tracking (if any) and start tracking a new one.
+// Returns the new request's id, to check it is still current, and its abort signal.
+const beginRequest = (requestRef) => {
+  requestRef.current.controller?.abort();
+  const controller = new AbortController();
+  requestRef.current = { id: requestRef.current.id + 1, controller };
+  return { id: requestRef.current.id, signal: controller.signal };
+};
+
+// Abort the tracked stream and make any responses still arriving for it stale
+const cancelRequest = (requestRef) => {
+  requestRef.current.controller?.abort();
+  requestRef.current = { id: requestRef.current.id + 1, controller: null };
+};
 
 function Home() {
   const [concept, setConcept] = useState('');
   const [knowledgeTree, setKnowledgeTree] = useState(null);
+  const requestTree = useMemo(() => knowledgeTree && treeForRequest(knowledgeTree), [knowledgeTree]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState(null);
   const [explanation, setExplanation] = useState(null);
@@ -19,6 +50,26 @@ function Home() {
   const [chatMessages, setChatMessages] = useState([]);
   const [chatInput, setChatInput] = useState('');
   const [chatLoading, setChatLoading] = useState(false);
+  // Name of the Gemini cached context for this explanation, echoed back on every chat turn
+  const [chatCacheName, setChatCacheName] = useState(null);
+
+  // The explanation and chat streams in flight; a newer request or closing the
+  // explanation aborts them, so a late chunk never lands in another concept's view
+  const explainRequestRef = useRef({ id: 0, controller: null });
+  const chatRequestRef = useRef({ id: 0, controller: null });
+
+  const cancelStreams = useCallback(() => {
+    cancelRequest(explainRequestRef);
+    cancelRequest(chatRequestRef);
+    setExplanationLoading(false);
+    setChatLoading(false);
+  }, []);
+
+  // Stop streaming into a page that is gone
+  useEffect(() => () => {
+    cancelRequest(explainRequestRef);
+    cancelRequest(chatRequestRef);
+  }, []);
 
   // Custom hooks
   const { tooltipRef, showTooltip, hideTooltip } = useTooltip();
@@ -27,22 +78,36 @@ function Home() {
   const handleNodeClick = useCallback(async (nodeData) => {
     if (!knowledgeTree || !concept) return;
     
+    cancelRequest(chatRequestRef); // The chat belongs to the previous explanation
+    const { id, signal } = beginRequest(explainRequestRef);
+    const isCurrent = () => explainRequestRef.current.id === id;
+    
     setSelectedConcept(nodeData.name);
     setExplanationLoading(true);
     setExplanation(null);
     setChatMessages([]); // Reset chat when opening new explanation
     setChatInput('');
+    setChatLoading(false);
+    setChatCacheName(null);
+    
+    // Explanations generated together with the map are shown right away
+    if (nodeData.explanation) {
+      setExplanation(nodeData.explanation);
+      setExplanationLoading(false);
+      return;
+    }
     
     try {
       const response = await fetch(`${API_URL}/api/explain-concept`, {
         method: 'POST',
+        signal,
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
           concept_name: nodeData.name,
           original_query: concept,
-          knowledge_tree: knowledgeTree
+          knowledge_tree: requestTree
         }),
       });
       
@@ -50,15 +115,22 @@ function Home() {
         throw new Error('Failed to generate explanation');
       }
 
-      const data = await response.json();
-      setExplanation(data.explanation);
+      // Show the explanation as soon as the first chunk arrives
+      await readEventStream(response, (chunk, fullText) => {
+        if (!isCurrent()) return;
+        setExplanation(fullText);
+        setExplanationLoading(false);
+      });
     } catch (err) {
+      if (!isCurrent()) return; // Superseded or closed; the abort is expected
       console.error('Error:', err);
       setExplanation('Error generating explanation. Please try again.');
     } finally {
-      setExplanationLoading(false);
+      if (isCurrent()) {
+        setExplanationLoading(false);
+      }
     }
-  }, [knowledgeTree, concept]);
+  }, [knowledgeTree, requestTree, concept]);
   
   // Handle chat message send
   const handleSendMessage = useCallback(async () => {
@@ -66,6 +138,8 @@ function Home() {
     
     const userMessage = chatInput.trim();
     setChatInput('');
+    const { id, signal } = beginRequest(chatRequestRef);
+    const isCurrent = () => chatRequestRef.current.id === id;
     
     // Add user message to chat
     const newUserMessage = { role: 'user', content: userMessage };
@@ -75,16 +149,18 @@ function Home() {
     try {
       const response = await fetch(`${API_URL}/api/chat-about-explanation`, {
         method: 'POST',
+        signal,
         headers: {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
           concept_name: selectedConcept,
           original_query: concept,
-          knowledge_tree: knowledgeTree,
+          knowledge_tree: requestTree,
           explanation: explanation,
-          chat_history: chatMessages,
-          user_message: userMessage
+          chat_history: chatMessages.slice(-MAX_CHAT_HISTORY),
+          user_message: userMessage,
+          cached_content: chatCacheName
         }),
       });
       
@@ -92,10 +168,25 @@ function Home() {
         throw new Error('Failed to get chat response');
       }
 
-      const data = await response.json();
-      const assistantMessage = { role: 'assistant', content: data.response };
-      setChatMessages(prev => [...prev, assistantMessage]);
+      // Add the assistant message on the first chunk, then keep updating it in place
+      let started = false;
+      await readEventStream(response, (chunk, fullText) => {
+        if (!isCurrent()) return;
+        const assistantMessage = { role: 'assistant', content: fullText };
+        if (!started) {
+          started = true;
+          setChatLoading(false);
+          setChatMessages(prev => [...prev, assistantMessage]);
+        } else {
+          setChatMessages(prev => [...prev.slice(0, -1), assistantMessage]);
+        }
+      }, (event) => {
+        if (isCurrent() && event.cached_content) {
+          setChatCacheName(event.cached_content);
+        }
+      });
     } catch (err) {
+      if (!isCurrent()) return; // Superseded or closed; the abort is expected
       console.error('Error:', err);
       const errorMessage = { 
         role: 'assistant', 
@@ -103,9 +194,11 @@ function Home() {
       };
       setChatMessages(prev => [...prev, errorMessage]);
     } finally {
-      setChatLoading(false);
+      if (isCurrent()) {
+        setChatLoading(false);
+      }
     }
-  }, [chatInput, chatLoading, explanation, selectedConcept, concept, knowledgeTree, chatMessages]);
+  }, [chatInput, chatLoading, explanation, selectedConcept, concept, requestTree, chatMessages, chatCacheName]);
   
   const { svgRef, treeDataRef, transformRef, zoomRef } = useD3Tree(
     knowledgeTree, 
@@ -130,7 +223,7 @@ function Home() {
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ concept: concept }),
+        body: JSON.stringify({ concept: concept, seed_depth: SEED_EXPLANATION_DEPTH }),
       });
       
       if (!response.ok) {
@@ -429,6 +522,7 @@ function Home() {
             backdropFilter: 'blur(4px)'
           }}
           onClick={() => {
+            cancelStreams();
             setExplanation(null);
             setSelectedConcept(null);
           }}
@@ -462,6 +556,7 @@ function Home() {
               </h2>
               <button
                 onClick={() => {
+                  cancelStreams();
                   setExplanation(null);
                   setSelectedConcept(null);
                   setChatMessages([]);
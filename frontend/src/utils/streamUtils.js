@@ -0,0 +1,44 @@
+/**
+ * Read a server-sent event stream from a fetch response.
+ * Each event carries a JSON payload like {"text": "..."} with the next chunk of markdown.
+ * @param {Response} response - fetch response with a text/event-stream body
+ * @param {Function} onText - Called with (chunk, fullTextSoFar) for every chunk received
+ * @param {Function} onEvent - Optional, called with the payload of every non-text event
+ * @returns {Promise<string>} The full text once the stream has finished
+ */
+export const readEventStream = async (response, onText, onEvent = null) => {
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  let fullText = '';
+
+  const handleEvent = (rawEvent) => {
+    rawEvent.split('\n').forEach(line => {
+      if (!line.startsWith('data:')) return;
+      const payload = JSON.parse(line.slice(5).trim());
+      if (payload.text) {
+        fullText += payload.text;
+        onText(payload.text, fullText);
+      } else if (onEvent) {
+        onEvent(payload);
+      }
+    });
+  };
+
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    // Events are separated by a blank line; keep any incomplete event in the buffer
+    const events = buffer.split('\n\n');
+    buffer = events.pop();
+    events.forEach(handleEvent);
+  }
+
+  if (buffer.trim()) {
+    handleEvent(buffer);
+  }
+
+  return fullText;
+};